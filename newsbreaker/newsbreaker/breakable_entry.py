@@ -121,16 +121,19 @@ class BreakableEntry(newsparser.Entry):
         self.doc = NLPDoc(self, nlp)
 
 
+    def _loaded(self):
+        # Without reading content, that would try to load it
+        return getattr(self, '_content', None) is not None
+
+
     # Make content available from the moment it's referenced
     @property
     def content(self):
-        if not hasattr(self, '_content') or self._content is None:
-            d = self.db[self.feedname].find_one({'index': self.index})
-            
-            if d is None: # not found in DB
+        if not self._loaded():
+            # To load the content of many entries at once,
+            # use newsparser.load_contents before accessing it
+            if newsparser.load_contents([self]): # not found in DB
                 raise Exception('Content not found in DB')
-            else:
-                self.content = d[self.CONTENT_KEY]                
 
         return self._content
 
@@ -1,11 +1,31 @@
 # -*- coding: utf-8 -*-
 # Author: Álvaro Parafita (parafita.alvaro@gmail.com)
 
+from newsparser import load_contents
 from newsparser.data import load_feeds
 from .breakable_entry import BreakableEntry
 
 
-def load_entries(folder, it=None):
+def load_entries(folder, it=None, load_content=False):
+    """
+        Returns the list of BreakableEntry of all feeds in folder,
+        or of the (feed, entries) pairs in it.
+        If load_content, their content is loaded in bulk from the DB.
+    """
+
+    entries = _load_entries(folder, it)
+
+    if load_content:
+        not_found = load_contents(entries)
+
+        if not_found:
+            raise Exception('Content not found in DB for %d entries' % \
+                len(not_found))
+
+    return entries
+
+
+def _load_entries(folder, it):
     if it is None:
         feeds = load_feeds(folder)
         
@@ -13,8 +33,9 @@ def load_entries(folder, it=None):
             BreakableEntry(entry.folder, feed, entry.get_metadata())
 
             for feed in feeds
-            for entry in feed.get_entries()
-            if entry.data.get('newsbreaker')
+            for entry in feed.iter_entries(
+                predicate=lambda entry: entry.data.get('newsbreaker')
+            )
         ]
     else:
         return [
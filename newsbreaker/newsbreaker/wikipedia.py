@@ -11,7 +11,8 @@ import wikipedia
 import requests # to try-catch its Exception base class
 import numpy as np
 
-from pymongo import MongoClient
+from newsparser.storage import database
+from newsparser.compression import compress, decompress
 
 from . import nlp
 from .utils import lazyinit
@@ -47,12 +48,7 @@ class WikiData:
     
 
     def __init__(self):
-        self.mongo_client = MongoClient()
-        self.db = self.mongo_client.wiki
-
-
-    def __del__(self):
-        self.mongo_client.close()
+        self.db = database('wiki')
     
     
     def article(self, pageid=None, title=None):
@@ -66,14 +62,12 @@ class WikiData:
 
         if pageid is None:
             d = self.db.articles.find_one({'title': title})
-
-            if d is not None:
-                return d # found it
         else:
             d = self.db.articles.find_one({'_id': pageid})
 
-            if d is not None:
-                return d # found it
+        if d is not None:
+            d['content'] = decompress(d['content'])
+            return d # found it
             
         try:
             if not(pageid is None):
@@ -110,7 +104,7 @@ class WikiData:
 
         self.db.articles.update_one(
             {'_id': d['_id']},
-            {'$set': d},
+            {'$set': dict(d, content=compress(d['content']))},
             upsert=True
         )
 
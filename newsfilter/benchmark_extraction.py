@@ -0,0 +1,78 @@
+# -*- coding: utf-8-*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Compares the extraction of the content of archived pages
+    (see newsparser.archive) with the content_selectors of each feed
+    against newspaper: throughput of both and agreement of their texts.
+"""
+
+import time
+
+from difflib import SequenceMatcher
+from itertools import islice
+
+import pandas as pd
+
+from newsparser.archive import html_archive, unpack
+from newsparser.downloader import extract_text, parse_article
+from newsfilter.ffs import content_selectors
+
+folder = '/Users/alvaro_parafita/Desktop/TFG/data'
+pages_per_feed = 200
+
+archive = html_archive(folder)
+selectors = content_selectors()
+
+rows = []
+for feedname in archive.feeds():
+    if feedname not in selectors:
+        continue
+
+    pages = [
+        (link, unpack(codec, data))
+        for _, link, codec, data in islice(
+            archive.iter_pages(feedname), pages_per_feed
+        )
+    ]
+
+    if not pages:
+        continue
+
+    start = time.time()
+    fast = [ extract_text(html, selectors[feedname]) for _, html in pages ]
+    fast_time = time.time() - start
+
+    start = time.time()
+    slow = [ parse_article(link, html) for link, html in pages ]
+    slow_time = time.time() - start
+
+    # Agreement of the words of both texts, when both extracted something
+    ratios = [
+        SequenceMatcher(None, a.split(), b.split()).ratio()
+        for a, b in zip(fast, slow)
+        if a is not None and b
+    ]
+
+    rows.append([
+        feedname,
+        len(pages),
+        sum(text is not None for text in fast) / len(pages),
+        len(pages) / fast_time if fast_time else float('inf'),
+        len(pages) / slow_time if slow_time else float('inf'),
+        sum(ratios) / len(ratios) if ratios else None
+    ])
+
+df = pd.DataFrame(
+    rows,
+    columns=[
+        'feed',
+        '# pages',
+        'selectors hit ratio',
+        'selectors pages/s',
+        'newspaper pages/s',
+        'agreement'
+    ]
+)
+
+print(df)
@@ -9,29 +9,17 @@ folder = '/Users/alvaro_parafita/Desktop/TFG/data'
 
 # Display statistics
 feeds = load_feeds(folder)
-entries = { feed: feed.get_entries() for feed in feeds }
+stats = { feed: feed.stats.get() for feed in feeds }
 
 df = pd.DataFrame(
     [
         [
             feed.name, 
-            len(entries[feed]),
-            sum(
-                not entry.data.get('filter', {}).get('discarded', True)
-                for entry in entries[feed]
-            ),
-            sum(
-                not entry.data.get('filter', {}).get('duplicate', True)
-                for entry in entries[feed]
-            ),
-            sum(
-                not entry.data.get('filter', {}).get('news_agency_discarded', True)
-                for entry in entries[feed]
-            ),
-            sum(
-                entry.data.get('newsbreaker', False)
-                for entry in entries[feed]
-            )
+            stats[feed]['entries'],
+            stats[feed]['flags']['filtered'],
+            stats[feed]['flags']['unique'],
+            stats[feed]['flags']['original'],
+            stats[feed]['flags']['newsbreaker']
         ]
         for feed in feeds
     ],
@@ -13,17 +13,14 @@ gf.filter_entries()
 
 # Display statistics
 feeds = load_feeds(folder)
-entries = { feed: feed.get_entries() for feed in feeds }
+stats = { feed: feed.stats.get() for feed in feeds }
 
 df = pd.DataFrame(
     [
         [
             feed.name, 
-            len(entries[feed]),
-            sum(
-                entry.data.get('newsbreaker', False)
-                for entry in entries[feed]
-            )
+            stats[feed]['entries'],
+            stats[feed]['flags']['newsbreaker']
         ]
         for feed in feeds
     ],
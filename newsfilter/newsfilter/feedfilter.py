@@ -8,11 +8,17 @@ from collections import Counter
 
 import pandas as pd
 import numpy as np
+from scipy import sparse
 from sklearn.externals import joblib
 
-from pymongo import MongoClient
 from spacy.en import English
 
+from newsparser import load_contents
+from newsparser.storage import database
+from newsparser.compression import compress
+
+from .patterns import PatternMatcher
+
 
 class PoliticsModel:
 
@@ -20,23 +26,81 @@ class PoliticsModel:
         with open(os.path.join(folder, 'politics_model', 'words.txt')) as f:
             self.WORDS = f.read().split('\n')
 
+        # {word: [columns of the features with its count]}
+        self.columns = {}
+        for column, w in enumerate(self.WORDS):
+            self.columns.setdefault(w, []).append(column)
+
         self.clf = joblib.load(
             os.path.join(folder, 'politics_model', 'politics_model.pkl')
         )
+        self._sparse = True # whether clf accepts sparse features
 
         self.nlp = English()
 
 
-    def build_features(self, entry):
-        doc = self.nlp(entry.content, tag=False, parse=False, entity=False)
-    
-        counter = Counter(
-            w.lower_
-            for w in doc
-            if w.is_alpha
+    def build_features_matrix(self, texts, batch_size=1000):
+        """
+            Returns a CSR matrix with the features of each of texts in a row:
+            the count of each word of WORDS in the text.
+            Texts are only tokenized, by batches of batch_size.
+        """
+
+        data, indices, indptr = [], [], [0]
+
+        for doc in self.nlp.tokenizer.pipe(texts, batch_size=batch_size):
+            counter = Counter(
+                w.lower_
+                for w in doc
+                if w.is_alpha
+            )
+
+            row = {}
+            for w, count in counter.items():
+                for column in self.columns.get(w, ()):
+                    row[column] = count
+
+            for column in sorted(row):
+                indices.append(column)
+                data.append(row[column])
+
+            indptr.append(len(indices))
+
+        return sparse.csr_matrix(
+            (np.array(data, dtype=np.int64), indices, indptr),
+            shape=(len(indptr) - 1, len(self.WORDS))
         )
-        
-        return np.array([counter.get(w, 0) for w in self.WORDS])
+
+
+    def build_features(self, entry):
+        return self.build_features_matrix([entry.content]).toarray()[0]
+
+
+    def predict(self, texts, batch_size=1000):
+        """
+            Returns a list with whether each of texts is about politics,
+            building the features and calling clf.predict once per batch.
+        """
+
+        texts = list(texts)
+        result = []
+
+        for i in range(0, len(texts), batch_size):
+            X = self.build_features_matrix(texts[i:i + batch_size], batch_size)
+
+            if self._sparse:
+                try:
+                    y = self.clf.predict(X)
+                except (TypeError, ValueError):
+                    # This classifier only accepts dense features
+                    self._sparse = False
+
+            if not self._sparse:
+                y = self.clf.predict(X.toarray())
+
+            result.extend(bool(x) for x in y)
+
+        return result
 
 
 class FeedFilter:
@@ -47,6 +111,8 @@ class FeedFilter:
 
     def __init__(self, folder):
         self.folder = folder
+        self._matchers = {} # {id(patterns): (patterns, PatternMatcher)}
+        self._politics = {} # {entry: politics}, see classify_politics
 
         self.title_filter_patterns['regex'] = [
             re.compile(s, flags=re.IGNORECASE) if type(s) == str else s
@@ -73,7 +139,7 @@ class FeedFilter:
     @property
     def db(self):
         if self.__class__._db is None:
-            self.__class__._db = MongoClient().entries
+            self.__class__._db = database('entries')
 
         return self._db
 
@@ -101,29 +167,31 @@ class FeedFilter:
         return bool(date)
 
 
-    def check_pattern(self, x, patterns):
-        """ Returns True if x fulfills any of the patterns in dict patterns """
+    def matcher(self, patterns):
+        """ Returns the PatternMatcher of dict patterns, compiled once """
 
-        for y in patterns.get('exact', []):
-            if y == x: return True
+        key = id(patterns)
+        if key not in self._matchers:
+            # Keep patterns, so that its id isn't reused
+            self._matchers[key] = (patterns, PatternMatcher(patterns))
 
-        lower = x.lower()
-        for y in patterns.get('lower', []):
-            if y == lower: return True
+        return self._matchers[key][1]
 
-        for y in patterns.get('contains', []):
-            if y in lower: return True
 
-        for regex in patterns.get('regex', []):
-            if regex.fullmatch(x): return True
+    def check_pattern(self, x, patterns):
+        """ Returns True if x fulfills any of the patterns in dict patterns """
+        return self.matcher(patterns).matches(x)
 
-        for func in patterns.get('funcs', []):
-            if func(x): return True
 
-        return False
+    # When inheriting from this class,
+    # fill this list with selectors of the paragraphs of the article body
+    # (CSS, or XPath if they start by /), tried in order
+    # to extract the content faster than with newspaper
+    # (see ffs.content_selectors and newsparser.downloader.parse_article)
+    content_selectors = []
 
 
-    # When inheriting from this class, 
+    # When inheriting from this class, 
     # fill these values to filter titles
     title_filter_patterns = {
         'exact': [], # exact match
@@ -181,13 +249,35 @@ class FeedFilter:
             to create this value in data, not filter entries based on that) 
         """
 
-        entry.data['politics'] = bool(
-            self.politics_model.clf.predict(
-                self.politics_model.build_features(entry)
-            )[0]
+        politics = self._politics.pop(entry, None)
+        if politics is None:
+            politics = self.politics_model.predict([entry.content])[0]
+
+        entry.data['politics'] = politics
+
+        return True # return True to avoid filtering by politics
+
+
+    def classify_politics(self, entries, batch_size=1000):
+        """
+            Classifies the entries with content that politics_filter
+            hasn't processed yet, by batches, and keeps the result
+            for politics_filter to use it.
+        """
+
+        entries = [
+            entry
+            for entry in entries
+            if entry.content is not None and 'politics_filter' not in
+                entry.data.get('filter', {}).get('step_flags', {})
+        ]
+
+        predictions = self.politics_model.predict(
+            [ entry.content for entry in entries ], batch_size=batch_size
         )
 
-        return True # return True to avoid filtering by politics
+        for entry, politics in zip(entries, predictions):
+            self._politics[entry] = politics
 
 
     paragraphs_filter_patterns = {
@@ -223,38 +313,15 @@ class FeedFilter:
             if p
         ]
 
-        filtered_paragraphs = []
-
-        for p in paragraphs:
-            if p in self.paragraphs_filter_patterns.get('exact', []):
-                continue
-
-            lower = p.lower()
+        matcher = self.matcher(self.paragraphs_filter_patterns)
 
-            if lower in self.paragraphs_filter_patterns.get('lower', []):
-                continue
-
-            if any(
-                x in lower 
-                for x in self.paragraphs_filter_patterns.get('contains', [])
-            ):
-                continue
-
-            if any(
-                bool(regex.fullmatch(p)) 
-                for regex in self.paragraphs_filter_patterns.get('regex', [])
-            ):
-                continue
-
-            for regex, groupname in self.paragraphs_filter_patterns.get(
-                'regex_group', []
-            ):
-                g = regex.fullmatch(p)
-                if g:
-                    p = g.group(groupname)
-                    break
-
-            filtered_paragraphs.append(p)
+        # Remove paragraphs matching any pattern (funcs aren't used here)
+        # and keep only the group of those matching a regex_group pattern
+        filtered_paragraphs = [
+            matcher.extract(p)
+            for p in paragraphs
+            if not matcher.matches(p, funcs=False)
+        ]
 
         entry.content = '\n'.join(filtered_paragraphs)
         
@@ -265,27 +332,64 @@ class FeedFilter:
     content_filters = [politics_filter, paragraphs_filter]
 
 
-    def filter_entry(self, entry):
-        def filter_iter(entry, filters, flags): 
-            for f, fname in map(lambda f: (f, f.__name__), filters):
-                if fname not in flags:
-                    flags[fname] = f(self, entry)
+    def _filter_iter(self, entry, filters, flags):
+        for f, fname in map(lambda f: (f, f.__name__), filters):
+            if fname not in flags:
+                flags[fname] = f(self, entry)
+
+            if not flags[fname]:
+                # Didn't pass a previous filter, so don't continue
+                return False
 
-                if not flags[fname]:
-                    # Didn't pass a previous filter, so don't continue
-                    return False
+        return True
 
-            return True
 
+    def _flags(self, entry):
         entry.data['filter'] = entry.data.get('filter', {})
         flags = entry.data['filter'].get('step_flags', {})
         entry.data['filter']['step_flags'] = flags
 
-        ok = filter_iter(entry, self.precontent_filters, flags)
+        return flags
+
+
+    def needs_content(self, entry):
+        """
+            Returns whether filter_entry will need the content of entry,
+            running (only once) the filters that don't need it
+        """
+
+        flags = self._flags(entry)
+
+        return self._filter_iter(entry, self.precontent_filters, flags) and \
+            not all(f.__name__ in flags for f in self.content_filters)
+
+
+    def filter_entries(self, entries, batch_size=1000):
+        """
+            Generator of (entry, filter_entry(entry)) for all entries,
+            loading the contents they need and classifying them
+            (see classify_politics) by batches of batch_size entries.
+        """
+
+        for i in range(0, len(entries), batch_size):
+            batch = entries[i:i + batch_size]
+
+            pending = [ entry for entry in batch if self.needs_content(entry) ]
+            load_contents(pending)
+            self.classify_politics(pending, batch_size=batch_size)
+
+            for entry in batch:
+                yield entry, self.filter_entry(entry)
+
+
+    def filter_entry(self, entry):
+        flags = self._flags(entry)
+
+        ok = self._filter_iter(entry, self.precontent_filters, flags)
         
         if ok and not all(f.__name__ in flags for f in self.content_filters):
-            entry.load_content() # make sure content is loaded
-            ok = filter_iter(entry, self.content_filters, flags)
+            entry.load_content() # make sure content is loaded
+            ok = self._filter_iter(entry, self.content_filters, flags)
 
             if ok:
                 # Entry content may have changed; we have to store it in db
@@ -293,7 +397,7 @@ class FeedFilter:
                     {'index': entry.index},
                     {
                         '$set': {
-                            'filtered_content': entry.content
+                            'filtered_content': compress(entry.content)
                         }
                     },
                     upsert=True
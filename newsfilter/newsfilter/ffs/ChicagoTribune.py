@@ -5,6 +5,10 @@ from . import FeedFilter
 
 class ChicagoTribune(FeedFilter):
 
+    content_selectors = [
+        'div.trb_ar_page p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [],
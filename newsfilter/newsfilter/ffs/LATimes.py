@@ -17,6 +17,10 @@ def try_to_datetime(title):
 class LATimes(FeedFilter):
 
 
+    content_selectors = [
+        'div.trb_ar_page p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [
@@ -5,6 +5,10 @@ from . import FeedFilter
 
 class NYPost(FeedFilter):
 
+    content_selectors = [
+        'div.entry-content p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [
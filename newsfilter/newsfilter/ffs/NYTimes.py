@@ -5,6 +5,11 @@ from . import FeedFilter
 
 class NYTimes(FeedFilter):
 
+    content_selectors = [
+        'p.story-body-text',
+        'section[name="articleBody"] p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [],
@@ -5,6 +5,10 @@ from . import FeedFilter
 
 class StLouisPost(FeedFilter):
 
+    content_selectors = [
+        'div.asset-content p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [],
@@ -5,6 +5,10 @@ from . import FeedFilter
 
 class USAToday(FeedFilter):
 
+    content_selectors = [
+        'p.p-text'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [],
@@ -5,6 +5,10 @@ from . import FeedFilter
 
 class WashingtonPost(FeedFilter):
 
+    content_selectors = [
+        'article[itemprop="articleBody"] p'
+    ]
+
     title_filter_patterns = {
         'exact': [],
         'lower': [],
@@ -9,4 +9,23 @@ from . import *
 def ff(feedname, folder):
     from importlib import import_module as imp
 
-    return getattr(imp('.' + feedname, __package__), feedname)(folder)
\ No newline at end of file
+    return getattr(imp('.' + feedname, __package__), feedname)(folder)
+
+def content_selectors():
+    """
+        Returns a dict {feedname: content_selectors} with the feeds
+        of this package that declare selectors for their article body,
+        to pass to newsparser's Downloader or updater.reextract.
+    """
+
+    from importlib import import_module as imp
+    from pkgutil import iter_modules
+
+    selectors = {}
+    for _, feedname, _ in iter_modules(__path__):
+        cls = getattr(imp('.' + feedname, __package__), feedname)
+
+        if cls.content_selectors:
+            selectors[feedname] = list(cls.content_selectors)
+
+    return selectors
@@ -7,8 +7,8 @@ from collections import Counter, defaultdict
 from datetime import timedelta
 
 from spacy.en import English
-from pymongo import MongoClient
 
+from newsparser import load_contents
 from newsparser.data import load_feeds
 
 from .ffs import ff
@@ -64,8 +64,8 @@ class GeneralFilter:
             feedfilter = ff(feed.name, self.folder)
             filtered_entries[feed] = []
 
-            for entry in self.entries[feed]:
-                if feedfilter.filter_entry(entry):
+            for entry, ok in feedfilter.filter_entries(self.entries[feed]):
+                if ok:
                     filtered_entries[feed].append(entry)
 
             # Since this is a huge process, save entries current status here
@@ -112,33 +112,44 @@ class GeneralFilter:
             set(news_agency_dates)
         )
 
-        db = MongoClient().entries # open connection to load filtered_content
+        # Entries are slotted, so per-entry state of these filters
+        # is kept in these dicts, keyed by entry
+        counters = {}
+        duplicate_sets = {}
+        agency_sets = {}
+
 
+        def load_date_contents(ents):
+            """ Loads the filtered content of all ents without a counter """
+            load_contents(
+                [ entry for entry in ents if entry not in counters ],
+                field='filtered_content'
+            )
 
         def load_counter(entry):
             """ Returns counter of entry, creating it if it didn't exist """
-            if hasattr(entry, 'counter'):
-                return entry.counter
+            if entry in counters:
+                return counters[entry]
 
-            # Get entry filtered content; note that only filtered entries get here
-            for d in db[entry.feedname].find({'index': entry.index}):
-                entry.content = d['filtered_content']
-                break
+            # Get entry filtered content; note that only filtered entries get here
+            # (usually already loaded in bulk by load_date_contents)
+            load_date_contents([entry])
 
             # Get its counter for later filters
             doc = self.nlp(entry.content, tag=False, parse=False, entity=False)
-            del entry.content # to save memory, since we won't need it anymore
+            entry.content = None # to save memory, since we won't need it anymore
 
-            entry.counter = Counter(
-                word.text # use text instead of lower_, we want to check absolute similarity
+            counter = Counter(
+                word.text # use text instead of lower_, we want to check absolute similarity
                 for word in doc
             )
 
-            s = sum(entry.counter.values())
-            for k in entry.counter:
-                entry.counter[k] /= s
+            s = sum(counter.values())
+            for k in counter:
+                counter[k] /= s
 
-            return entry.counter
+            counters[entry] = counter
+            return counter
 
         # Duplicate filter
         print('Duplicate filter')
@@ -158,37 +169,39 @@ class GeneralFilter:
                 ] # avoid all already-duplicate entries
                 
                 for entry in ents:
-                    if not hasattr(entry, 'duplicate_set'):
-                        entry.duplicate_set = { entry }
+                    if entry not in duplicate_sets:
+                        duplicate_sets[entry] = { entry }
+
+                load_date_contents(ents)
 
                 for i, e1 in enumerate(ents):
                     feed_ents.add(e1)
                         
                     for e2 in ents[i+1:]:
                         if counter_dist(load_counter(e1), load_counter(e2)) >= dist_threshold:
-                            union = e1.duplicate_set.union(e2.duplicate_set)
+                            union = duplicate_sets[e1].union(duplicate_sets[e2])
                             for e in union:
-                                e.duplicate_set = union
+                                duplicate_sets[e] = union
                                 
             while feed_ents:
                 entry = feed_ents.pop()
 
                 # From entry.duplicate_set, get an entry that hasn't been labelled
                 # as duplicate
-                for e1 in entry.duplicate_set:
+                for e1 in duplicate_sets[entry]:
                     if not e1.data['filter'].get('duplicate', True):
                         feed_ents.add(entry)
                         feed_ents.remove(e1)
                         entry = e1
                         break
 
-                entry.duplicate_set.remove(entry)
+                duplicate_sets[entry].remove(entry)
                 
                 # first popped from duplicate_set won't be duplicated; the rest is
                 entry.data['filter']['duplicate'] = False 
                 
-                while entry.duplicate_set:
-                    e2 = entry.duplicate_set.pop()
+                while duplicate_sets[entry]:
+                    e2 = duplicate_sets[entry].pop()
                     feed_ents.remove(e2)
                     e2.data['filter']['duplicate'] = True # will be filtered
 
@@ -212,37 +225,39 @@ class GeneralFilter:
             ], key=lambda e: e.data['date'])
 
             for entry in ents:
-                if not hasattr(entry, 'agency_set'):
-                    entry.agency_set = { entry }
+                if entry not in agency_sets:
+                    agency_sets[entry] = { entry }
+
+            load_date_contents(ents)
 
             for i, e1 in enumerate(ents):
                 all_ents.add(e1)
 
                 for e2 in ents[i+1:]:
                     if counter_dist(load_counter(e1), load_counter(e2)) >= dist_threshold:
-                        union = e1.agency_set.union(e2.agency_set)
+                        union = agency_sets[e1].union(agency_sets[e2])
                         for e in union:
-                            e.agency_set = union
+                            agency_sets[e] = union
                                 
         while all_ents:
             entry = all_ents.pop()
 
-            for e1 in entry.agency_set:
+            for e1 in agency_sets[entry]:
                 if not e1.data['filter'].get('news_agency_discarded', True):
                     all_ents.add(entry)
                     all_ents.remove(e1)
                     entry = e1
                     break
 
-            entry.agency_set.remove(entry)
+            agency_sets[entry].remove(entry)
 
             # if there's anything else in the set, this is a news agency item
-            entry.data['filter']['news_agency'] = bool(entry.agency_set)
+            entry.data['filter']['news_agency'] = bool(agency_sets[entry])
             # first poped from agency_set won't be discarded; the rest is
             entry.data['filter']['news_agency_discarded'] = False
 
-            while entry.agency_set:
-                e2 = entry.agency_set.pop()
+            while agency_sets[entry]:
+                e2 = agency_sets[entry].pop()
                 all_ents.remove(e2)
                 e2.data['filter']['news_agency'] = True # if we got here, the set had > 1 items.
                 e2.data['filter']['news_agency_discarded'] = True # will be filtered     
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class PatternMatcher, that compiles a dict of patterns
+    of FeedFilter (exact, lower, contains, regex, regex_group, funcs)
+    so that matching a text costs about the same
+    whatever the number of patterns:
+        * exact and lower - sets
+        * contains - an Aho-Corasick automaton if pyahocorasick
+            is installed, or a single regex with all the strings otherwise
+        * regex and regex_group - a single regex with all the patterns
+            as alternatives (one per set of flags)
+        * funcs - called in order, as before
+"""
+
+import re
+
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+
+# Patterns that refer to their own groups by number or name
+# can't be combined with others
+BACKREFERENCE_REGEX = re.compile(r'\\[1-9]|\(\?P=')
+
+
+def _regex(p):
+    return re.compile(p, flags=re.IGNORECASE) if type(p) == str else p
+
+
+class RegexSet(object):
+    """
+        Regexes combined in alternations, to find with a single fullmatch
+        the first of them that fullmatches a text.
+    """
+
+    def __init__(self, regexes):
+        self.regexes = [ _regex(r) for r in regexes ]
+
+        # [(combined regex, [index of the regex of each alternative])],
+        # or (None, [index]) for regexes that can't be combined
+        self.groups = []
+
+        by_flags = {}
+        for i, regex in enumerate(self.regexes):
+            if BACKREFERENCE_REGEX.search(regex.pattern) or \
+                    type(regex.pattern) != str:
+                self.groups.append((None, [i]))
+            else:
+                by_flags.setdefault(regex.flags, []).append(i)
+
+        for flags, indexes in by_flags.items():
+            try:
+                combined = re.compile(
+                    '|'.join(
+                        '(?P<_%d>%s)' % (n, self.regexes[i].pattern)
+                        for n, i in enumerate(indexes)
+                    ),
+                    flags=flags
+                )
+            except re.error:
+                # e.g. the same group name in two patterns
+                self.groups.extend((None, [i]) for i in indexes)
+            else:
+                self.groups.append((combined, indexes))
+
+        # Sorted by their first regex, for fullmatch to stop early
+        self.groups.sort(key=lambda group: group[1][0])
+
+
+    def __bool__(self):
+        return bool(self.regexes)
+
+
+    def fullmatch(self, x):
+        """
+            Returns (index, match) of the first regex that fullmatches x,
+            with match being the match of that regex alone,
+            or None if none of them does.
+        """
+
+        best = None
+
+        for combined, indexes in self.groups:
+            if best is not None and indexes[0] > best[0]:
+                break # no regex in this group comes before
+
+            if combined is None:
+                i = indexes[0]
+            else:
+                m = combined.fullmatch(x)
+                if not m:
+                    continue
+
+                # Alternatives are tried in order, so this is the first one;
+                # its group closes after the ones inside it, so it is the last
+                i = indexes[int(m.lastgroup[1:])]
+
+            m = self.regexes[i].fullmatch(x)
+            if m and (best is None or i < best[0]):
+                best = (i, m)
+
+        return best
+
+
+    def any(self, x):
+        """ Returns True if any of the regexes fullmatches x """
+
+        for combined, indexes in self.groups:
+            regex = combined if combined is not None else \
+                self.regexes[indexes[0]]
+
+            if regex.fullmatch(x):
+                return True
+
+        return False
+
+
+class PatternMatcher(object):
+
+    def __init__(self, patterns):
+        """
+            Parameters:
+                patterns - dict of patterns, as FeedFilter's
+                    title_filter_patterns or paragraphs_filter_patterns
+        """
+
+        self.exact = set(patterns.get('exact', []))
+        self.lower = set(patterns.get('lower', []))
+
+        contains = list(patterns.get('contains', []))
+        self._contains_empty = '' in contains
+        contains = [ s for s in contains if s ]
+
+        if not contains:
+            self._automaton = self._contains_regex = None
+        elif ahocorasick is not None:
+            self._automaton = ahocorasick.Automaton()
+            for s in contains:
+                self._automaton.add_word(s, s)
+            self._automaton.make_automaton()
+
+            self._contains_regex = None
+        else:
+            self._automaton = None
+            self._contains_regex = re.compile(
+                '|'.join(map(re.escape, contains))
+            )
+
+        self.regex = RegexSet(patterns.get('regex', []))
+
+        group_patterns = patterns.get('regex_group', [])
+        self.regex_group = RegexSet([ r for r, _ in group_patterns ])
+        self.groupnames = [ groupname for _, groupname in group_patterns ]
+
+        self.funcs = list(patterns.get('funcs', []))
+
+
+    def contains(self, lower):
+        """ Returns True if lower contains any of the contains patterns """
+
+        if self._contains_empty:
+            return True
+
+        if self._automaton is not None:
+            for _ in self._automaton.iter(lower):
+                return True
+
+            return False
+
+        if self._contains_regex is not None:
+            return self._contains_regex.search(lower) is not None
+
+        return False
+
+
+    def matches(self, x, funcs=True):
+        """
+            Returns True if x fulfills any of the patterns
+            (except regex_group); funcs are only checked if funcs is True.
+        """
+
+        if x in self.exact:
+            return True
+
+        lower = x.lower()
+        if lower in self.lower or self.contains(lower):
+            return True
+
+        if self.regex.any(x):
+            return True
+
+        if funcs:
+            for func in self.funcs:
+                if func(x): return True
+
+        return False
+
+
+    def extract(self, x):
+        """
+            Returns the group of the first regex_group pattern
+            that fullmatches x, or x itself if none does.
+        """
+
+        if not self.regex_group:
+            return x
+
+        found = self.regex_group.fullmatch(x)
+        if found is None:
+            return x
+
+        i, m = found
+        return m.group(self.groupnames[i])
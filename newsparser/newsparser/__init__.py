@@ -7,7 +7,7 @@ __url__ = 'https://github.com/aparafita/news-similarity'
 logging_file = 'feed_retrieval.log'
 
 from .feed import Feed
-from .entry import Entry
+from .entry import Entry, load_contents
 
 import logging
 # logging.basicConfig(
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class HtmlArchive, the optional archive of the raw html
+    of the downloaded articles, so that their text can be extracted again
+    (with a better extractor, or after a publisher changed its layout)
+    without downloading them again (see updater.reextract).
+
+    Pages are stored compressed in the html.sqlite file of the corpus folder,
+    keyed by (feed name, entry index), along with the link they came from
+    (after following redirects). They are compressed with zstd
+    if zstandard is installed, or zlib otherwise; each page records its codec.
+
+    The archive is written by Downloader(archive=True) for every page
+    it fetches, even if it couldn't be parsed.
+"""
+
+import os
+import os.path
+import sqlite3
+import threading
+import zlib
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+_archives = {}
+_archives_lock = threading.Lock()
+
+
+def html_archive(folder):
+    """ Returns the process-wide HtmlArchive of the corpus in folder """
+
+    key = os.path.abspath(folder)
+
+    with _archives_lock:
+        if key not in _archives:
+            _archives[key] = HtmlArchive(folder)
+
+        return _archives[key]
+
+
+def pack(html):
+    """ Returns (codec, compressed bytes) of html """
+
+    data = html.encode('utf-8')
+
+    if zstd is not None:
+        return 'zstd', zstd.ZstdCompressor().compress(data)
+    else:
+        return 'zlib', zlib.compress(data)
+
+
+def unpack(codec, data):
+    """ Returns the html compressed by pack """
+
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+
+    elif codec == 'zstd':
+        if zstd is None:
+            raise ImportError('zstd compression requires zstandard')
+
+        data = zstd.ZstdDecompressor().decompress(data)
+
+    else:
+        raise ValueError('Unknown compression codec "%s"' % codec)
+
+    return data.decode('utf-8')
+
+
+class HtmlArchive(object):
+
+    ARCHIVE_FILE = 'html.sqlite'
+
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder of the corpus, where feeds.json is
+        """
+
+        self.folder = folder
+        self.path = os.path.join(folder, self.ARCHIVE_FILE)
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+
+            # Pages are archived from downloader threads; they share it
+            connection = sqlite3.connect(
+                self.path, timeout=60, check_same_thread=False
+            )
+
+            with connection:
+                connection.execute('PRAGMA journal_mode=WAL')
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS pages ('
+                    'feed TEXT NOT NULL, '
+                    'idx INTEGER NOT NULL, '
+                    'link TEXT, '
+                    'codec TEXT NOT NULL, '
+                    'html BLOB NOT NULL, '
+                    'PRIMARY KEY (feed, idx))'
+                )
+
+            self._connection = connection
+
+        return self._connection
+
+
+    def exists(self):
+        return os.path.exists(self.path)
+
+
+    def put(self, feedname, index, link, html):
+        """ Archives html, downloaded from link, for entry index of feedname """
+
+        codec, data = pack(html)
+
+        with self._lock, self.connection as c:
+            c.execute(
+                'INSERT OR REPLACE INTO pages (feed, idx, link, codec, html) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (feedname, index, link, codec, data)
+            )
+
+
+    def get(self, feedname, index):
+        """ Returns (link, html) of entry index of feedname, None if missing """
+
+        if not self.exists():
+            return None
+
+        with self._lock:
+            row = self.connection.execute(
+                'SELECT link, codec, html FROM pages '
+                'WHERE feed = ? AND idx = ?',
+                (feedname, index)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return row[0], unpack(row[1], row[2])
+
+
+    def feeds(self):
+        """ Returns a list with the names of the feeds with archived pages """
+
+        if not self.exists():
+            return []
+
+        with self._lock:
+            return [
+                row[0]
+                for row in self.connection.execute(
+                    'SELECT DISTINCT feed FROM pages ORDER BY feed'
+                )
+            ]
+
+
+    def iter_pages(self, feedname, low=None, high=None, batch_size=1000):
+        """
+            Generator of (index, link, codec, compressed html)
+            of the archived pages of feedname with low <= index < high,
+            sorted by index; unpack(codec, compressed html) returns the html.
+            Pages are left compressed so they can be sent to other processes
+            and decompressed there.
+        """
+
+        if not self.exists():
+            return
+
+        low = 0 if low is None else low
+        high = float('inf') if high is None else high
+
+        while True:
+            # Read by batches instead of keeping a cursor open,
+            # so that writers aren't blocked meanwhile
+            with self._lock:
+                rows = self.connection.execute(
+                    'SELECT idx, link, codec, html FROM pages '
+                    'WHERE feed = ? AND idx >= ? AND idx < ? '
+                    'ORDER BY idx LIMIT ?',
+                    (feedname, low, high, batch_size)
+                ).fetchall()
+
+            for row in rows:
+                yield row
+
+            if len(rows) < batch_size:
+                return
+
+            low = rows[-1][0] + 1
+
+
+    def __len__(self):
+        """ Number of archived pages """
+
+        if not self.exists():
+            return 0
+
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM pages'
+            ).fetchone()[0]
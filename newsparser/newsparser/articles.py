@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class ArticleStore, the content-addressed store
+    of the texts of the articles, shared by all feeds.
+
+    Wire stories and syndicated articles appear in many feeds,
+    often with links that only differ in tracking parameters
+    or that redirect to the same page. Texts are stored once,
+    keyed by the hash of their content, and every canonical link
+    (see canonical_link) they were fetched from points to that hash:
+        articles.links - {'link': canonical link, 'hash': content hash}
+        articles.contents - {'hash': content hash, 'content': text}
+    with texts compressed as in the rest of databases (see compression).
+
+    Entry.save_content stores its text here and keeps only a reference
+    {'article': hash} in the entry document, so an entry whose link
+    was already fetched by any feed reuses the text without downloading it.
+
+    Link documents also keep the validators of the page the text
+    was extracted from: its ETag and Last-Modified headers and the hash
+    of its html ('etag', 'modified' and 'page'), so that refreshing
+    the content (see Downloader.download) sends conditional requests
+    and doesn't parse or store again pages that didn't change.
+"""
+
+import hashlib
+
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+from .storage import database
+from .compression import compress, decompress
+
+
+# Query parameters that only track where the visit comes from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'dclid', 'msclkid', 'yclid', 'igshid',
+    'mc_cid', 'mc_eid', '_ga', '_gl', 'cmpid', 'ncid', 'ocid', 'smid',
+    'ito', 'ref_src', 'rss'
+}
+TRACKING_PREFIXES = ('utm_',)
+
+DEFAULT_PORTS = { 'http': 80, 'https': 443 }
+
+
+def canonical_link(link):
+    """
+        Returns link normalized so that links to the same article compare
+        equal: lowercase scheme and host, without default port, fragment
+        or tracking parameters, and with the rest of parameters sorted.
+        Redirects are resolved by the callers that fetch the link.
+    """
+
+    if not link:
+        return link
+
+    parts = urlsplit(link.strip())
+
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+
+    try:
+        port = parts.port
+    except ValueError:
+        port = None # invalid port; leave it out
+
+    netloc = host
+    if port is not None and port != DEFAULT_PORTS.get(scheme):
+        netloc += ':%d' % port
+
+    query = sorted(
+        (k, v)
+        for k, v in parse_qsl(parts.query, keep_blank_values=True)
+        if k.lower() not in TRACKING_PARAMS
+        and not k.lower().startswith(TRACKING_PREFIXES)
+    )
+
+    return urlunsplit(
+        (scheme, netloc, parts.path or '/', urlencode(query), '')
+    )
+
+
+def content_hash(content):
+    """ Returns the key of content in the store """
+    return hashlib.sha1(content.encode('utf-8')).hexdigest()
+
+
+def is_reference(value):
+    """ Returns whether a stored content value is a reference to the store """
+    return isinstance(value, dict) and 'article' in value
+
+
+class ArticleStore(object):
+
+    def __init__(self, db):
+        """
+            Parameters:
+                db - database where to keep the links and contents collections
+        """
+
+        self.db = db
+        self._indexed = False
+
+
+    def _collections(self):
+        links, contents = self.db['links'], self.db['contents']
+
+        if not self._indexed:
+            links.create_index('link')
+            contents.create_index('hash')
+            self._indexed = True
+
+        return links, contents
+
+
+    def lookup(self, link):
+        """
+            Returns the hash of the content fetched from link
+            (or any link with the same canonical link), None if there's none.
+        """
+
+        links, _ = self._collections()
+
+        d = links.find_one(
+            { 'link': canonical_link(link) }, { 'hash': 1, '_id': 0 }
+        )
+
+        return d['hash'] if d is not None else None
+
+
+    def validators(self, link):
+        """
+            Returns a dict with the validators ('etag', 'modified', 'page')
+            recorded when the content of link was fetched,
+            None if there's none.
+        """
+
+        links, _ = self._collections()
+
+        d = links.find_one(
+            { 'link': canonical_link(link) },
+            { 'etag': 1, 'modified': 1, 'page': 1, '_id': 0 }
+        )
+
+        if d is None or not any(d.values()):
+            return None
+
+        return {
+            'etag': d.get('etag'),
+            'modified': d.get('modified'),
+            'page': d.get('page')
+        }
+
+
+    def get(self, h):
+        """ Returns the content with hash h, None if it isn't stored """
+        return self.get_many([h]).get(h)
+
+
+    def get_many(self, hashes, batch_size=1000):
+        """ Returns a dict {hash: content} with the stored hashes """
+
+        _, contents = self._collections()
+
+        hashes = sorted(set(hashes))
+        result = {}
+
+        for i in range(0, len(hashes), batch_size):
+            for d in contents.find(
+                { 'hash': { '$in': hashes[i:i + batch_size] } },
+                { 'hash': 1, 'content': 1, '_id': 0 }
+            ):
+                result[d['hash']] = decompress(d['content'])
+
+        return result
+
+
+    def put(self, content, links=(), validators=None):
+        """
+            Stores content, unless it is already stored,
+            and records it as the content fetched from all links,
+            along with validators of the page it was extracted from, if given.
+            Returns its hash.
+        """
+
+        links_collection, contents = self._collections()
+
+        h = content_hash(content)
+
+        if contents.find_one({ 'hash': h }, { '_id': 1 }) is None:
+            contents.update_one(
+                { 'hash': h },
+                { '$set': { 'content': compress(content) }},
+                upsert=True
+            )
+
+        update = { 'hash': h }
+        if validators is not None:
+            update.update(
+                (k, validators.get(k)) for k in ('etag', 'modified', 'page')
+            )
+
+        for link in set(canonical_link(link) for link in links if link):
+            links_collection.update_one(
+                { 'link': link }, { '$set': update }, upsert=True
+            )
+
+        return h
+
+
+store = ArticleStore(database('articles'))
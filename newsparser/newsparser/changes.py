@@ -0,0 +1,224 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class ChangeLog, the corpus-wide log of changes to entries.
+
+    Every Feed.save_entries appends a change per saved entry
+    to the changes.jsonl file of the corpus folder, one JSON per line:
+        {"seq": 1234, "feed": "feedname", "index": 56, "kind": "new"}
+    where seq is a sequence number, increasing across all feeds,
+    and kind is "new" (entry added) or "update" (entry modified).
+
+    Incremental consumers keep the last seq they processed
+    and call changes(since_seq) to get only what happened after it.
+
+    Usage example:
+        changelog = ChangeLog(folder)
+
+        for change in changelog.changes(since_seq=last_seq):
+            ...
+            last_seq = change['seq']
+"""
+
+import os
+import os.path
+import json
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # no locks between processes (only between threads)
+
+
+CHANGES_FILE = 'changes.jsonl'
+
+_changelogs = {}
+_changelogs_lock = threading.Lock()
+
+
+def changelog(folder):
+    """ Returns the process-wide ChangeLog of the corpus in folder """
+
+    key = os.path.abspath(folder)
+
+    with _changelogs_lock:
+        if key not in _changelogs:
+            _changelogs[key] = ChangeLog(folder)
+
+        return _changelogs[key]
+
+
+class ChangeLog(object):
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder of the corpus, where feeds.json is
+        """
+
+        self.folder = folder
+        self.path = os.path.join(folder, CHANGES_FILE)
+
+        self._lock = threading.Lock()
+        self._last = (0, 0) # (file size, last seq) last time we checked
+
+
+    def _read_last_seq(self, f, size):
+        """ Returns the seq of the last complete line of f, of size bytes """
+
+        block = 4096
+        while True:
+            start = max(0, size - block)
+            f.seek(start)
+
+            lines = f.read(size - start).split(b'\n')
+            if start:
+                lines = lines[1:] # the first one may be incomplete
+
+            for line in reversed(lines):
+                try:
+                    return json.loads(line.decode('utf-8'))['seq']
+                except (ValueError, KeyError):
+                    pass # empty, partial or corrupt line
+
+            if not start:
+                return 0
+
+            block *= 2
+
+
+    def last_seq(self):
+        """ Returns the seq of the last change, 0 if there isn't any """
+
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+        if size == self._last[0]:
+            return self._last[1]
+
+        with open(self.path, 'rb') as f:
+            seq = self._read_last_seq(f, size)
+
+        self._last = (size, seq)
+        return seq
+
+
+    def record(self, feedname, changes):
+        """
+            Appends the changes of feed feedname, a list of (index, kind),
+            assigning them consecutive seq numbers.
+            Returns the seq of the last of them.
+        """
+
+        if not changes:
+            return self.last_seq()
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        with self._lock, open(self.path, 'ab+') as f:
+            if fcntl is not None:
+                # Other processes may be writing changes too
+                fcntl.flock(f, fcntl.LOCK_EX)
+
+            try:
+                f.seek(0, os.SEEK_END)
+                size = f.tell()
+
+                seq = self._last[1] if size == self._last[0] else \
+                    self._read_last_seq(f, size)
+
+                lines = []
+                for index, kind in changes:
+                    seq += 1
+                    lines.append(json.dumps({
+                        'seq': seq,
+                        'feed': feedname,
+                        'index': index,
+                        'kind': kind
+                    }))
+
+                data = ('\n'.join(lines) + '\n').encode('utf-8')
+
+                # If a previous write was interrupted, start a new line
+                if size:
+                    f.seek(size - 1)
+                    if f.read(1) != b'\n':
+                        data = b'\n' + data
+
+                f.seek(0, os.SEEK_END)
+                f.write(data)
+                f.flush()
+
+                self._last = (size + len(data), seq)
+
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+        return seq
+
+
+    def _seq_at(self, f, offset):
+        """
+            Returns the seq of the first complete line after offset
+            (the one at offset if it is 0), or None if there's none.
+        """
+
+        f.seek(offset)
+        if offset:
+            f.readline() # we may be in the middle of a line
+
+        for line in f:
+            try:
+                return json.loads(line.decode('utf-8'))['seq']
+            except (ValueError, KeyError):
+                continue # partial or corrupt line
+
+
+    def changes(self, since_seq=0):
+        """
+            Generator of the changes with seq > since_seq, in seq order.
+            Seqs only grow, so the start is found by binary search
+            and the cost depends only on the number of changes returned.
+        """
+
+        try:
+            f = open(self.path, 'rb')
+        except OSError:
+            return
+
+        with f:
+            size = os.fstat(f.fileno()).st_size
+
+            # Find the offset of a line with seq <= since_seq
+            # such that all the following lines have seq > since_seq
+            low, high = 0, size
+            while low < high:
+                mid = (low + high) // 2
+                seq = self._seq_at(f, mid)
+
+                if seq is None or seq > since_seq:
+                    high = mid
+                else:
+                    low = mid + 1
+
+            f.seek(low)
+            if low:
+                f.readline()
+
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break # being written
+
+                try:
+                    change = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue # partial or corrupt line
+
+                if change['seq'] > since_seq:
+                    yield change
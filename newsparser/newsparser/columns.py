@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class FeedColumns, an optional columnar representation
+    of the metadata of a feed's entries, stored as memory-mapped NumPy arrays.
+    It allows whole-corpus scans (counts by flag or by date, for instance)
+    without building an Entry for each record.
+
+    Every column is a flat binary file where position i holds
+    the value for entry index i, so updating an entry is a write in place
+    and adding entries only extends the files.
+    Titles are appended to a blob only when they change,
+    and the blob is rewritten without the replaced ones
+    when the feed is compacted (see Feed.compact).
+"""
+
+import os
+import os.path
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+class FeedColumns(object):
+    """
+        Columns of a feed:
+            index - int64, entry index or -1 if there's no entry there
+            date - datetime64[D], entry.data['date'] or NaT
+            flags - uint16, bitfield with the flags in FLAGS
+            title_offset, title_length - int64, location of the entry title
+                in the titles blob file, encoded in utf-8
+    """
+
+    COLUMNS = {
+        'index': 'int64',
+        'date': 'datetime64[D]',
+        'flags': 'uint16',
+        'title_offset': 'int64',
+        'title_length': 'int64'
+    }
+
+    TITLES_FILE = 'titles.bin'
+
+    # Each flag is a function (entry) -> bool
+    FLAGS = [
+        ('downloaded', lambda e: bool(e.downloaded)),
+        ('filtered', # passed its feed filter
+            lambda e: e.data.get('filter', {}).get('discarded') is False),
+        ('unique', # not discarded by the duplicate filter
+            lambda e: e.data.get('filter', {}).get('duplicate') is False),
+        ('original', # not discarded by the news agency filter
+            lambda e: e.data.get('filter', {}).get(
+                'news_agency_discarded'
+            ) is False),
+        ('news_agency',
+            lambda e: bool(e.data.get('filter', {}).get('news_agency'))),
+        ('newsbreaker', lambda e: bool(e.data.get('newsbreaker'))),
+        ('politics', lambda e: bool(e.data.get('politics'))),
+    ]
+
+    FLAG_BITS = { name: 1 << n for n, (name, _) in enumerate(FLAGS) }
+
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder where to store the columns,
+                    usually a subfolder of the feed folder.
+        """
+
+        if np is None:
+            raise ImportError('FeedColumns requires numpy')
+
+        self.folder = folder
+        self._maps = {} # {column: (size, memmap)}
+
+
+    def exists(self):
+        return os.path.exists(self._path('index'))
+
+
+    def _path(self, column):
+        return os.path.join(self.folder, column + '.bin')
+
+
+    def __len__(self):
+        try:
+            return os.path.getsize(self._path('index')) // 8
+        except OSError:
+            return 0
+
+
+    def column(self, column):
+        """ Returns a read-only memory-mapped array of the given column """
+
+        dtype = np.dtype(self.COLUMNS[column])
+        n = len(self)
+
+        size, mmap = self._maps.get(column, (None, None))
+
+        if size != n:
+            if n:
+                mmap = np.memmap(
+                    self._path(column), dtype=dtype, mode='r', shape=(n,)
+                )
+            else:
+                mmap = np.zeros(0, dtype=dtype)
+
+            self._maps[column] = (n, mmap)
+
+        return mmap
+
+
+    @property
+    def index(self): return self.column('index')
+
+    @property
+    def date(self): return self.column('date')
+
+    @property
+    def flags(self): return self.column('flags')
+
+
+    def flag(self, name):
+        """ Returns a boolean array with the value of flag name """
+        return (self.flags & self.FLAG_BITS[name]) != 0
+
+
+    def present(self):
+        """ Returns a boolean array, True where there's an entry """
+        return self.index >= 0
+
+
+    def titles(self, positions):
+        """ Returns the titles of the entries in positions """
+
+        offsets = self.column('title_offset')
+        lengths = self.column('title_length')
+
+        with open(os.path.join(self.folder, self.TITLES_FILE), 'rb') as f:
+            titles = []
+
+            for i in positions:
+                f.seek(offsets[i])
+                # A compaction may be replacing the blob right now
+                titles.append(f.read(lengths[i]).decode('utf-8', 'replace'))
+
+        return titles
+
+
+    def _grow(self, n):
+        """ Extends all columns to length n with missing values """
+
+        current = len(self)
+        if n <= current:
+            return
+
+        missing = {
+            'index': -1,
+            'date': np.datetime64('NaT'),
+        }
+
+        # index is the last one to grow, since it defines len(self)
+        for column in sorted(self.COLUMNS, key=lambda c: c == 'index'):
+            dtype = np.dtype(self.COLUMNS[column])
+
+            with open(self._path(column), 'ab') as f:
+                f.truncate(current * dtype.itemsize)
+                f.seek(current * dtype.itemsize)
+
+                np.full(
+                    n - current, missing.get(column, 0), dtype=dtype
+                ).tofile(f)
+
+
+    def update(self, entries):
+        """ Writes the columns of the given entries in their positions """
+
+        entries = list(entries)
+        if not entries:
+            return
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        self._grow(max(e.index for e in entries) + 1)
+
+        positions = np.array([e.index for e in entries], dtype='int64')
+
+        # Append to the blob only the titles that changed,
+        # so that saving unchanged entries doesn't grow it
+        titles = [(e.title or '').encode('utf-8') for e in entries]
+
+        offsets = np.array(self.column('title_offset')[positions])
+        lengths = np.array(self.column('title_length')[positions])
+        present = self.index[positions] >= 0
+
+        path = os.path.join(self.folder, self.TITLES_FILE)
+        with open(path, 'a+b') as f:
+            changed = []
+            for n, title in enumerate(titles):
+                if present[n] and lengths[n] == len(title):
+                    f.seek(offsets[n])
+                    if f.read(lengths[n]) == title:
+                        continue
+
+                changed.append(n)
+
+            f.seek(0, os.SEEK_END)
+            start = f.tell()
+            f.write(b''.join(titles[n] for n in changed))
+
+        changed = np.array(changed, dtype='int64')
+        new_lengths = np.array([len(titles[n]) for n in changed], dtype='int64')
+
+        lengths[changed] = new_lengths
+        offsets[changed] = start + np.concatenate(
+            ([0], np.cumsum(new_lengths)[:-1])
+        )[:len(changed)]
+
+        dates = []
+        for e in entries:
+            try:
+                dates.append(np.datetime64(e.data.get('date') or 'NaT', 'D'))
+            except ValueError:
+                dates.append(np.datetime64('NaT'))
+
+        flags = np.array([
+            sum(self.FLAG_BITS[name] for name, f in self.FLAGS if f(e))
+            for e in entries
+        ], dtype='uint16')
+
+        values = {
+            'index': positions,
+            'date': np.array(dates, dtype='datetime64[D]'),
+            'flags': flags,
+            'title_offset': offsets,
+            'title_length': lengths,
+        }
+
+        n = len(self)
+        for column, dtype in self.COLUMNS.items():
+            mmap = np.memmap(
+                self._path(column), dtype=dtype, mode='r+', shape=(n,)
+            )
+            mmap[positions] = values[column]
+            mmap.flush()
+
+            del mmap
+
+        self._maps = {} # force remapping
+
+
+    def compact(self):
+        """
+            Rewrites the titles blob with only the current titles,
+            dropping the ones that were replaced by later updates.
+            Callers must make sure that no one updates the columns meanwhile.
+        """
+
+        n = len(self)
+        path = os.path.join(self.folder, self.TITLES_FILE)
+
+        if not n or not os.path.exists(path):
+            return
+
+        positions = np.flatnonzero(self.present())
+        lengths = self.column('title_length')
+
+        if lengths[positions].sum() == os.path.getsize(path):
+            return # nothing to drop
+
+        offsets = self.column('title_offset')
+        new_offsets = np.zeros(n, dtype='int64')
+        new_offsets[positions] = np.concatenate(
+            ([0], np.cumsum(lengths[positions])[:-1])
+        )[:len(positions)]
+
+        # Write the new blob aside and replace the old one,
+        # and then point the offsets to it, in place,
+        # so that the memory maps of other readers see them too
+        tmp = path + '.tmp'
+        with open(path, 'rb') as old, open(tmp, 'wb') as f:
+            for i in positions:
+                old.seek(offsets[i])
+                f.write(old.read(lengths[i]))
+
+        os.replace(tmp, path)
+
+        mmap = np.memmap(
+            self._path('title_offset'), dtype='int64', mode='r+', shape=(n,)
+        )
+        mmap[:] = new_offsets
+        mmap.flush()
+
+        del mmap
+
+        self._maps = {} # force remapping
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with the transparent compression of the texts stored
+    in the databases of the project (article contents, Wikipedia pages).
+
+    Stored texts are either plain strings (uncompressed, as always)
+    or dicts {'compression': codec, 'data': bytes}
+    (plus 'dictionary', the id of the zstd dictionary, if used),
+    so each document records how it was stored
+    and decompress works with all of them, whatever the current codec.
+
+    Compression is disabled by default. Enable it with configure(codec)
+    or with the environment variable NEWSPARSER_COMPRESSION (zlib or zstd).
+    zstd requires the zstandard package and can use a dictionary
+    trained with train_dictionary from a sample of texts,
+    which works much better with short texts like news articles.
+"""
+
+import os
+import zlib
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+
+ENV_VARIABLE = 'NEWSPARSER_COMPRESSION'
+CODECS = ('zlib', 'zstd')
+MIN_SIZE = 256 # texts shorter than this aren't worth compressing
+
+_codec = None
+_level = None
+_dictionary = None # zstd.ZstdCompressionDict used to compress
+_dictionaries = {} # {dictionary id: zstd.ZstdCompressionDict}
+
+
+def configure(codec=None, level=None, dictionary=None):
+    """
+        Sets how texts are compressed from now on.
+
+        Parameters:
+            codec - None (no compression), 'zlib' or 'zstd'
+            level - compression level of the codec; None for its default
+            dictionary - bytes of a zstd dictionary (see train_dictionary);
+                texts compressed with it need it to be loaded
+                (either with configure or load_dictionary) to decompress
+    """
+
+    global _codec, _level, _dictionary
+
+    if codec is not None and codec not in CODECS:
+        raise ValueError('Unknown compression codec "%s"' % codec)
+
+    if codec == 'zstd' and zstd is None:
+        raise ImportError('zstd compression requires zstandard')
+
+    _codec = codec
+    _level = level
+    _dictionary = None if dictionary is None else load_dictionary(dictionary)
+
+
+def load_dictionary(data):
+    """ Makes the zstd dictionary in data available for decompression """
+
+    if zstd is None:
+        raise ImportError('zstd compression requires zstandard')
+
+    dictionary = zstd.ZstdCompressionDict(data)
+    _dictionaries[dictionary.dict_id()] = dictionary
+
+    return dictionary
+
+
+def train_dictionary(texts, size=110 * 1024):
+    """ Returns the bytes of a zstd dictionary trained with texts """
+
+    if zstd is None:
+        raise ImportError('zstd compression requires zstandard')
+
+    return zstd.train_dictionary(
+        size, [ text.encode('utf-8') for text in texts ]
+    ).as_bytes()
+
+
+def _current_codec():
+    if _codec is not None:
+        return _codec
+
+    codec = os.environ.get(ENV_VARIABLE) or None
+    if codec is not None and codec not in CODECS:
+        raise ValueError('Unknown compression codec "%s"' % codec)
+
+    return codec
+
+
+def compress(text):
+    """ Returns the value to store for text with the current codec """
+
+    codec = _current_codec()
+
+    if codec is None or text is None or len(text) < MIN_SIZE:
+        return text
+
+    data = text.encode('utf-8')
+    value = { 'compression': codec }
+
+    if codec == 'zlib':
+        value['data'] = zlib.compress(data, -1 if _level is None else _level)
+
+    else:
+        kwargs = {}
+        if _level is not None:
+            kwargs['level'] = _level
+
+        if _dictionary is not None:
+            kwargs['dict_data'] = _dictionary
+            value['dictionary'] = _dictionary.dict_id()
+
+        value['data'] = zstd.ZstdCompressor(**kwargs).compress(data)
+
+    return value
+
+
+def decompress(value):
+    """ Returns the text stored as value, compressed or not """
+
+    if not isinstance(value, dict):
+        return value # plain text
+
+    codec = value['compression']
+    data = bytes(value['data'])
+
+    if codec == 'zlib':
+        data = zlib.decompress(data)
+
+    elif codec == 'zstd':
+        if zstd is None:
+            raise ImportError('zstd compression requires zstandard')
+
+        kwargs = {}
+        if 'dictionary' in value:
+            if value['dictionary'] not in _dictionaries:
+                raise KeyError(
+                    'zstd dictionary %d not loaded' % value['dictionary']
+                )
+
+            kwargs['dict_data'] = _dictionaries[value['dictionary']]
+
+        data = zstd.ZstdDecompressor(**kwargs).decompress(data)
+
+    else:
+        raise ValueError('Unknown compression codec "%s"' % codec)
+
+    return data.decode('utf-8')
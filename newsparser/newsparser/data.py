@@ -1,14 +1,46 @@
 # -*- coding: utf-8 -*-
 # Author: Álvaro Parafita (parafita.alvaro@gmail.com)
 
-import json
-import os.path
-
-from . import Feed
+from .changes import changelog
+from .registry import registry
 
 
 def load_feeds(folder):
-    """ Loads all Feed instances retrivable from feeds.json """
+    """
+        Loads all Feed instances retrivable from feeds.json.
+        Feeds are cached by the registry of folder (see registry module),
+        so only the files changed since the last call are read again.
+    """
+
+    return registry(folder).feeds()
+
+
+def changes(folder, since_seq=0):
+    """
+        Generator of the changes to entries in the corpus
+        with seq > since_seq (see changes.ChangeLog)
+    """
+
+    return changelog(folder).changes(since_seq)
+
+
+def iter_entries(folder, predicate=None, feeds=None):
+    """
+        Generator of all entries in the corpus, interleaving feeds
+        (one entry of each feed in turn), so that memory use is bounded
+        by a chunk per feed. If predicate is given, only entries for which
+        predicate(entry) is True are yielded.
+        feeds can be given to avoid loading them again from folder.
+    """
+
+    if feeds is None:
+        feeds = load_feeds(folder)
+
+    iterators = [ feed.iter_entries(predicate=predicate) for feed in feeds ]
 
-    with open(os.path.join(folder, 'feeds.json')) as f:
-        return [Feed(folder, j['name']) for j in json.loads(f.read())]
\ No newline at end of file
+    while iterators:
+        for it in list(iterators):
+            try:
+                yield next(it)
+            except StopIteration:
+                iterators.remove(it)
@@ -0,0 +1,564 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class Downloader, that downloads the content
+    of many entries concurrently.
+
+    Pages are fetched by a pool of threads. Entries wait in a queue
+    per domain and a thread is only given an entry whose domain is due,
+    at least domain_delay seconds after its previous request,
+    so that many publishers are downloaded at the same time,
+    none of them gets more than one request every domain_delay seconds
+    and no thread waits for a domain while others could be fetched.
+    Articles are then parsed by newspaper in a pool of processes,
+    since parsing is CPU-bound.
+
+    Usage example:
+        with Downloader() as downloader:
+            for entry in downloader.download(entries):
+                # entry.content and entry.downloaded are already set
+                ...
+
+    A Downloader can run several downloads at the same time
+    (from different threads); they share the per-domain limits,
+    the pool of fetching threads and the pool of parsing processes.
+"""
+
+import re
+import time
+import codecs
+import threading
+
+from collections import OrderedDict, deque
+from functools import lru_cache
+from concurrent.futures import (
+    Future, ThreadPoolExecutor, ProcessPoolExecutor
+)
+from urllib.parse import urlparse
+
+import requests
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from newspaper import Article, ArticleException
+
+from . import __version__, __url__
+from .articles import content_hash
+from .archive import html_archive
+
+import logging
+
+
+USER_AGENT = "newsparser/{version} +{url}".format(
+    version=__version__,
+    url=__url__
+)
+
+
+# Charset of the Content-Type header, and the one declared in the html
+# itself (<meta charset> or http-equiv)
+HEADER_CHARSET_REGEX = re.compile(
+    r'charset\s*=\s*["\']?([\w.:-]+)', flags=re.IGNORECASE
+)
+META_CHARSET_REGEX = re.compile(
+    br'<meta[^>]+charset\s*=\s*["\']?\s*([\w.:-]+)', flags=re.IGNORECASE
+)
+
+
+def _codec(encoding):
+    """ Returns the normalized name of encoding, None if it isn't known """
+
+    try:
+        return codecs.lookup(encoding).name
+    except (LookupError, TypeError):
+        return None
+
+
+def decode_html(response):
+    """
+        Returns the html of response as text, decoded with the charset
+        of its Content-Type header, or else the one declared in the html,
+        or else the one guessed from its bytes.
+
+        Unlike response.text, it doesn't assume ISO-8859-1
+        for text/html responses without a charset.
+    """
+
+    content = response.content or b''
+
+    encoding = None
+
+    m = HEADER_CHARSET_REGEX.search(response.headers.get('Content-Type', ''))
+    if m:
+        encoding = _codec(m.group(1))
+
+    if encoding is None:
+        m = META_CHARSET_REGEX.search(content[:4096])
+        if m:
+            encoding = _codec(m.group(1).decode('ascii', 'ignore'))
+
+    if encoding is None:
+        encoding = _codec(response.apparent_encoding) or 'utf-8'
+
+    return content.decode(encoding, errors='replace')
+
+
+@lru_cache(maxsize=None)
+def _compile(selector):
+    """ Returns a function (element) -> matches for selector """
+
+    if selector.startswith('/'):
+        return etree.XPath(selector)
+    else:
+        return CSSSelector(selector)
+
+
+def _text(node):
+    if isinstance(node, str):
+        text = node # XPath string results (e.g. .../text())
+    else:
+        text = node.text_content()
+
+    return ' '.join(text.split())
+
+
+def extract_text(html, selectors, min_paragraphs=2):
+    """
+        Fast extraction of the text of the article in html
+        with the first of selectors that matches at least min_paragraphs
+        non-empty paragraphs (each match being a paragraph).
+        Selectors are CSS selectors, or XPath expressions if they start by /.
+        Returns None if none of them matches.
+    """
+
+    try:
+        try:
+            doc = lxml.html.fromstring(html)
+        except ValueError:
+            # Strings with an encoding declaration are only parsed as bytes
+            doc = lxml.html.fromstring(html.encode('utf-8'))
+    except (etree.ParserError, ValueError):
+        return None
+
+    for selector in selectors:
+        paragraphs = [ p for p in map(_text, _compile(selector)(doc)) if p ]
+
+        if len(paragraphs) >= min_paragraphs:
+            return '\n\n'.join(paragraphs)
+
+    return None
+
+
+def parse_article(link, html, selectors=None):
+    """
+        Extracts the text of the article in html, downloaded from link.
+        If selectors of the body of the article are given,
+        tries them first (see extract_text), which is much faster,
+        and uses newspaper only if none of them matches.
+        Returns None if newspaper couldn't parse it.
+    """
+
+    if selectors:
+        text = extract_text(html, selectors)
+
+        if text is not None:
+            return text
+
+    article = Article(link)
+
+    try:
+        article.download(input_html=html)
+        article.parse()
+    except ArticleException:
+        return None
+
+    return article.text.strip()
+
+
+class DomainScheduler(object):
+    """
+        Runs tasks in executors so that each domain gets one request
+        every delay seconds, without threads sleeping meanwhile:
+        tasks wait in a queue per domain, and a scheduler thread
+        submits one of them whenever its domain is due,
+        with up to max_running tasks running at the same time,
+        so the workers of the executors are only given requests
+        they can make right away.
+    """
+
+    def __init__(self, delay, max_running):
+        self.delay = delay
+        self.max_running = max_running
+
+        self._cond = threading.Condition()
+        self._queues = OrderedDict() # {domain: deque of tasks}
+        self._next = {} # {domain: time of its next request}
+        self._running = 0
+        self._thread = None
+
+
+    def submit(self, executor, link, fn, *args, future=None):
+        """
+            Schedules fn(*args) to be run in executor once the domain
+            of link is due. Returns the Future of its result,
+            which is future if given.
+        """
+
+        if future is None:
+            future = Future()
+
+        domain = urlparse(link or '').netloc
+
+        with self._cond:
+            self._queues.setdefault(domain, deque()).append(
+                (executor, fn, args, future)
+            )
+
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+            self._cond.notify()
+
+        return future
+
+
+    def close(self):
+        """ Stops the scheduler thread; queued tasks are cancelled """
+
+        with self._cond:
+            for queue in self._queues.values():
+                for _, _, _, future in queue:
+                    future.cancel()
+
+            self._queues.clear()
+
+            thread, self._thread = self._thread, None
+            self._cond.notify()
+
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+
+    def _run(self):
+        me = threading.current_thread()
+
+        with self._cond:
+            while self._thread is me:
+                now = time.time()
+                wait = None
+
+                for domain in list(self._queues):
+                    if self._running >= self.max_running:
+                        wait = None # until a task finishes
+                        break
+
+                    due = self._next.get(domain, 0)
+                    if due > now:
+                        wait = due - now if wait is None else \
+                            min(wait, due - now)
+                        continue
+
+                    queue = self._queues[domain]
+                    executor, fn, args, future = queue.popleft()
+
+                    if queue:
+                        self._queues.move_to_end(domain) # domains take turns
+                    else:
+                        del self._queues[domain]
+
+                    if not future.set_running_or_notify_cancel():
+                        continue # cancelled; its domain is still free
+
+                    self._next[domain] = now + self.delay
+                    self._running += 1
+
+                    try:
+                        executor.submit(self._call, fn, args, future)
+                    except RuntimeError as e: # executor shut down
+                        self._running -= 1
+                        future.set_exception(e)
+
+                self._cond.wait(wait)
+
+
+    def _call(self, fn, args, future):
+        try:
+            result = fn(*args)
+        except BaseException as e:
+            future.set_exception(e)
+        else:
+            future.set_result(result)
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._cond.notify()
+
+
+class Downloader(object):
+
+    def __init__(
+        self, max_workers=16, domain_delay=0.5, processes=None, timeout=30,
+        archive=False, selectors=None
+    ):
+        """
+            Parameters:
+                max_workers - number of pages fetched at the same time
+                domain_delay - seconds between two requests to the same domain
+                processes - number of processes that parse articles;
+                    None to use the number of CPUs,
+                    0 to parse them in the fetching threads instead
+                timeout - seconds before aborting a request
+                archive - whether to keep the html of every fetched page
+                    in the archive of the corpus of its entry
+                    (see archive.HtmlArchive)
+                selectors - dict {feed name: list of selectors}
+                    of the body of the articles of each feed,
+                    to extract them without newspaper when possible
+                    (see parse_article)
+        """
+
+        self.max_workers = max_workers
+        self.domain_delay = domain_delay
+        self.processes = processes
+        self.timeout = timeout
+        self.archive = archive
+        self.selectors = selectors or {}
+
+        self._local = threading.local()
+        self._scheduler = DomainScheduler(domain_delay, max_workers)
+
+        self._fetcher = None
+        self._parser = None
+        self._pools_lock = threading.Lock()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+    def close(self):
+        """ Shuts down the fetching threads and the parsing processes """
+
+        self._scheduler.close()
+
+        with self._pools_lock:
+            if self._fetcher is not None:
+                self._fetcher.shutdown()
+                self._fetcher = None
+
+            if self._parser is not None:
+                self._parser.shutdown()
+                self._parser = None
+
+
+    @property
+    def fetcher(self):
+        """
+            ThreadPoolExecutor that fetches pages,
+            shared by all the downloads of this Downloader
+        """
+
+        with self._pools_lock:
+            if self._fetcher is None:
+                self._fetcher = ThreadPoolExecutor(self.max_workers)
+
+            return self._fetcher
+
+
+    @property
+    def parser(self):
+        """ ProcessPoolExecutor that parses articles (None if processes=0) """
+
+        with self._pools_lock:
+            if self._parser is None and self.processes != 0:
+                self._parser = ProcessPoolExecutor(self.processes)
+
+            return self._parser
+
+
+    @property
+    def session(self):
+        """ requests.Session of the current thread """
+
+        if not hasattr(self._local, 'session'):
+            self._local.session = requests.Session()
+            self._local.session.headers['User-Agent'] = USER_AGENT
+
+        return self._local.session
+
+
+    def get(self, link, validators=None):
+        """
+            Returns the response to link, after following its redirects,
+            or None if it couldn't be downloaded.
+
+            If validators of a previous download of link are given
+            (see ArticleStore.validators), the request is conditional:
+            the response is a 304 with no content if the page didn't change.
+        """
+
+        headers = {}
+        if validators is not None:
+            if validators.get('etag'):
+                headers['If-None-Match'] = validators['etag']
+            if validators.get('modified'):
+                headers['If-Modified-Since'] = validators['modified']
+
+        try:
+            response = self.session.get(
+                link, timeout=self.timeout, headers=headers
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            logging.info('Couldn\'t download "{link}": {e}'.format(
+                link=link, e=e
+            ))
+
+            return None
+
+        return response
+
+
+    def fetch(self, link):
+        """ Returns the html in link, or None if it couldn't be downloaded """
+
+        response = self.get(link)
+
+        return decode_html(response) if response is not None else None
+
+
+    def download(self, entries, refresh=False):
+        """
+            Generator that downloads the content of all entries
+            and yields them, in the same order, once downloaded.
+            Entries that were already downloaded are yielded as they are,
+            and so are entries whose link (after following redirects)
+            was already fetched by another entry, reusing its content
+            (see Entry.reuse_content).
+
+            Entries that couldn't be downloaded or parsed
+            are left with downloaded = False and content = ''
+            and queued to be retried later (see Entry.download_failed).
+
+            If refresh, already downloaded entries are fetched again
+            with conditional requests, and their content is only parsed
+            and stored again if their page changed since it was downloaded.
+            If that fails, they keep their current content.
+        """
+
+        fetcher, parser = self.fetcher, self.parser
+
+        def prepare(entry):
+            # Resolves the entries that need no request; returns whether
+            # entry is done, so that the others are queued for their domain
+            if entry.downloaded:
+                return not refresh
+
+            return entry.reuse_content() is not None
+
+        def process(entry):
+            refreshing = entry.downloaded
+
+            validators = None
+            if refreshing and entry.articles is not None:
+                validators = entry.articles.validators(entry.link)
+
+            response = self.get(entry.link, validators)
+
+            if response is not None and response.status_code == 304:
+                return entry # not modified
+
+            text = url = None
+            if response is not None:
+                html, url = decode_html(response), response.url
+                page = content_hash(html)
+
+                if validators is not None and validators['page'] == page:
+                    return entry # not modified, but the server ignored them
+
+                if self.archive:
+                    html_archive(entry.folder).put(
+                        entry.feedname, entry.index, url, html
+                    )
+
+                # Redirected to an article that was already fetched
+                if not refreshing and url != entry.link and \
+                        entry.reuse_content(url) is not None:
+                    return entry
+
+                selectors = self.selectors.get(entry.feedname)
+
+                if parser is None:
+                    text = parse_article(entry.link, html, selectors)
+                else:
+                    text = parser.submit(
+                        parse_article, entry.link, html, selectors
+                    ).result()
+
+            if text is None:
+                if not refreshing:
+                    entry.download_failed()
+            else:
+                entry.save_content(
+                    text, links=[url], validators={
+                        'etag': response.headers.get('ETag'),
+                        'modified': response.headers.get('Last-Modified'),
+                        'page': page
+                    }
+                )
+
+            return entry
+
+        def schedule(entry, result):
+            def prepared(future):
+                try:
+                    done = future.result()
+                except BaseException as e:
+                    if result.set_running_or_notify_cancel():
+                        result.set_exception(e)
+                else:
+                    if done:
+                        if result.set_running_or_notify_cancel():
+                            result.set_result(entry)
+                    elif not result.cancelled():
+                        # Fetched once its domain is due,
+                        # without holding a thread while it waits
+                        self._scheduler.submit(
+                            fetcher, entry.link, process, entry,
+                            future=result
+                        )
+
+            fetcher.submit(prepare, entry).add_done_callback(prepared)
+
+        # Keep a bounded window of pending entries,
+        # so that memory doesn't grow with the number of entries
+        pending = deque()
+        max_pending = 4 * self.max_workers
+
+        try:
+            for entry in entries:
+                result = Future()
+                pending.append(result)
+
+                if entry.downloaded and not refresh:
+                    result.set_result(entry)
+                else:
+                    schedule(entry, result)
+
+                while pending and (
+                    len(pending) >= max_pending or pending[0].done()
+                ):
+                    yield pending.popleft().result()
+
+            while pending:
+                yield pending.popleft().result()
+
+        finally:
+            for future in pending:
+                future.cancel()
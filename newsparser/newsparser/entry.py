@@ -13,20 +13,40 @@ from datetime import datetime
 
 from newspaper import Article, ArticleException
 
-try:
-    from pymongo import MongoClient
-    db = MongoClient().entries
+from .storage import database
+from .compression import compress, decompress
+from .pending import pending_queue
+from .articles import store as article_store, is_reference
 
-except:
-    db = None
+db = database('entries')
+
+
+_indexed = set() # (db, feedname) whose collection is known to be indexed
 
 
 class Entry(object):
+    """
+        Entries are slotted and keep their metadata as the raw JSON record
+        read from the feed storage until any of its fields is accessed,
+        so that loading a whole corpus takes as little memory as possible.
+    """
+
+    __slots__ = (
+        'folder', 'feedname', 'content', '_index', '_hash', '_raw', '_fields'
+    )
+
     db = db
+    articles = article_store
 
     CONTENT_KEY = 'raw_content'
 
-    def __init__(self, folder, feedname, data):
+    # Metadata fields, decoded on first access (see _field below)
+    FIELDS = (
+        'entryid', 'link', 'title', 'author', 'published', 'tags', 
+        'downloaded', 'data'
+    )
+
+    def __init__(self, folder, feedname, data=None, record=None, index=None):
         """
             Constructor of entry. 
 
@@ -35,23 +55,62 @@ class Entry(object):
                     the feed folder.
                 feedname - name of the feed this entry belongs to
                 data - dict with all the metadata of the entry
+                record - instead of data, bytes with the JSON-encoded
+                    metadata of the entry; it is only decoded when needed
+                index - index of the entry, when given a record
         """
 
         self.folder = folder
         self.feedname = feedname
+        self.content = None
 
-        self.index = int(data['index'])
-        self.entryid = data.get('entryid', data.get('link'))
-        self.link = data.get('link')
-        self.title = data.get('title')
-        self.author = data.get('author')
-        self.published = data.get('published')
-        self.tags = data.get('tags')
+        self._raw = None
+        self._fields = None
 
-        self.downloaded = data.get('downloaded', False)
-        self.content = None
+        if data is None and index is None:
+            data = json.loads(record.decode('utf-8'))
+
+        if data is not None:
+            self._set_fields(data)
+            index = data['index']
+        else:
+            self._raw = record
+
+        self.index = index
+
+
+    @property
+    def index(self):
+        return self._index
 
-        self.data = data.get('data', {})
+
+    @index.setter
+    def index(self, value):
+        self._index = int(value)
+        self._hash = hash((self.feedname, self._index))
+
+
+    def _set_fields(self, data):
+        self._fields = [
+            data.get('entryid', data.get('link')),
+            data.get('link'),
+            data.get('title'),
+            data.get('author'),
+            data.get('published'),
+            data.get('tags'),
+            data.get('downloaded', False),
+            data.get('data', {})
+        ]
+
+
+    def _decoded(self):
+        """ Returns the list of field values, decoding the record if needed """
+
+        if self._fields is None:
+            self._set_fields(json.loads(self._raw.decode('utf-8')))
+            self._raw = None # won't be needed anymore
+
+        return self._fields
 
 
     def get_metadata(self):
@@ -87,13 +146,42 @@ class Entry(object):
 
 
     def __hash__(self):
-        return hash('%s%d' % (self.feedname, self.index))
+        return self._hash
 
 
     def __eq__(self, other):
         return self.feedname == other.feedname and self.index == other.index
 
 
+    @classmethod
+    def collection(cls, feedname):
+        """
+            Returns the DB collection with the contents of feed feedname,
+            making sure it has an index on the entry index.
+        """
+
+        if cls.db is None:
+            raise Exception('Trying to access content without a DB')
+
+        collection = cls.db[feedname]
+
+        key = (id(cls.db), feedname)
+        if key not in _indexed:
+            collection.create_index('index')
+            _indexed.add(key)
+
+        return collection
+
+
+    def _loaded(self):
+        """
+            Returns whether the content is already in memory,
+            without loading it (subclasses may load it on access).
+        """
+
+        return self.content is not None
+
+
     def load_content(self):
         if self.db is None:
             raise Exception('Trying to load content without a DB')
@@ -102,35 +190,205 @@ class Entry(object):
             return self.content
 
         if self.downloaded:
-            d = self.db[self.feedname].find_one({'index': self.index})
+            d = self.collection(self.feedname).find_one(
+                { 'index': self.index }, { self.CONTENT_KEY: 1 }
+            )
 
             if d is None:
                 # Entry not found
                 raise Exception('Entry content not found in DB')
+
+            value = d[self.CONTENT_KEY]
+
+            if is_reference(value):
+                self.content = self.articles.get(value['article'])
+
+                if self.content is None:
+                    raise Exception('Entry content not found in DB')
             else:
-                self.content = d[self.CONTENT_KEY]
-                return self.content # and avoid entering for-else
+                self.content = decompress(value)
+
+            return self.content # and avoid entering for-else
 
         else:
+            # Another entry may have fetched the same article already
+            content = self.reuse_content()
+            if content is not None:
+                return content
+
             # Try downloading it and storing its content to DB
             article = Article(self.link)
 
             try:
                 article.download()
                 article.parse()
-                self.content = article.text.strip()
-
-                self.db[self.feedname].update_one(
-                    { 'index': self.index },
-                    { '$set': { self.CONTENT_KEY: self.content }},
-                    upsert=True
-                )
 
-                self.downloaded = True
-                return self.content
+                return self.save_content(article.text.strip())
                 
             except ArticleException:
-                # Don't write anything. It can be downloaded later (or not)
-                self.downloaded = False
-                self.content = ''
-                return self.content
\ No newline at end of file
+                return self.download_failed()
+
+
+    def download_failed(self):
+        """
+            Marks this entry as not downloaded and queues it
+            to be retried later (see pending.PendingQueue).
+            Returns the (empty) content.
+        """
+
+        # Don't write anything. It can be downloaded later (or not)
+        self.downloaded = False
+        self.content = ''
+
+        pending_queue(self.folder).failed(self.feedname, self.index)
+
+        return self.content
+
+
+    def reuse_content(self, link=None):
+        """
+            If the article in link (by default, the entry link)
+            was already fetched, by this or any other feed,
+            saves its stored text as the content of this entry
+            and returns it. Returns None otherwise.
+        """
+
+        if self.articles is None:
+            return None
+
+        h = self.articles.lookup(link or self.link)
+        if h is None:
+            return None
+
+        content = self.articles.get(h)
+        if content is None:
+            return None
+
+        return self.save_content(content, links=[link])
+
+
+    def save_content(self, content, links=(), validators=None):
+        """
+            Stores content, already downloaded and parsed,
+            as the content of this entry in the DB and marks it as downloaded.
+
+            The text itself is kept in the article store (see articles module),
+            recorded as the content of the entry link and of links,
+            the other links it was fetched from (e.g. after redirects),
+            and the entry document only references it.
+            validators of the page are recorded too (see ArticleStore.put).
+        """
+
+        if self.db is None:
+            raise Exception('Trying to save content without a DB')
+
+        self.content = content
+
+        if self.articles is None:
+            value = compress(self.content)
+        else:
+            value = { 'article': self.articles.put(
+                self.content, [self.link] + [l for l in links if l],
+                validators
+            )}
+
+        self.collection(self.feedname).update_one(
+            { 'index': self.index },
+            { '$set': { self.CONTENT_KEY: value }},
+            upsert=True
+        )
+
+        self.downloaded = True
+        pending_queue(self.folder).succeeded(self.feedname, self.index)
+
+        return self.content
+
+
+def load_contents(entries, field=None, batch_size=1000):
+    """
+        Loads the stored content of all the given entries
+        with one query per feed and batch_size entries,
+        retrieving only the content field.
+
+        field is the document key to load as content;
+        if None, each entry's CONTENT_KEY is used.
+        Entries whose content was already loaded are skipped.
+
+        Returns a list with the entries whose content wasn't found.
+    """
+
+    groups = {} # {(entry class, feedname, field): {index: [entries]}}
+    for entry in entries:
+        if entry._loaded():
+            continue
+
+        key = (type(entry), entry.feedname, field or entry.CONTENT_KEY)
+        groups.setdefault(key, {}).setdefault(entry.index, []).append(entry)
+
+    not_found = []
+    references = {} # {(article store, hash): [entries]}
+
+    for (cls, feedname, key), by_index in groups.items():
+        collection = cls.collection(feedname)
+        indexes = sorted(by_index)
+
+        for i in range(0, len(indexes), batch_size):
+            batch = indexes[i:i + batch_size]
+
+            for d in collection.find(
+                { 'index': { '$in': batch } },
+                { 'index': 1, key: 1, '_id': 0 }
+            ):
+                if key not in d:
+                    continue
+
+                value = d[key]
+                if is_reference(value):
+                    references.setdefault(
+                        (cls.articles, value['article']), []
+                    ).extend(by_index.pop(d['index'], []))
+
+                    continue
+
+                content = decompress(value)
+                for entry in by_index.pop(d['index'], []):
+                    entry.content = content
+
+        not_found.extend(e for l in by_index.values() for e in l)
+
+    # Load the contents in the article store, with one query per batch
+    stores = {} # {id(article store): (article store, hashes)}
+    for articles, h in references:
+        stores.setdefault(id(articles), (articles, []))[1].append(h)
+
+    for articles, hashes in stores.values():
+        contents = articles.get_many(hashes, batch_size=batch_size)
+
+        for h in hashes:
+            entries = references[articles, h]
+
+            if h in contents:
+                for entry in entries:
+                    entry.content = contents[h]
+            else:
+                not_found.extend(entries)
+
+    return not_found
+
+
+def _field(n, name):
+    """ Returns a property for the n-th field in Entry.FIELDS """
+
+    def fget(self):
+        return self._decoded()[n]
+
+    def fset(self, value):
+        self._decoded()[n] = value
+
+    return property(fget, fset, doc='Entry metadata field "%s"' % name)
+
+
+for n, name in enumerate(Entry.FIELDS):
+    setattr(Entry, name, _field(n, name))
+
+del n, name
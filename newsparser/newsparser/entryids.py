@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class EntryIdSet, a persistent set of the entryids
+    already stored in a feed, so that new entries can be detected
+    without reading the whole feed history.
+"""
+
+import os
+import os.path
+import json
+import math
+import struct
+import hashlib
+import threading
+
+
+def _digest(key):
+    return hashlib.md5(key.encode('utf-8')).digest()
+
+
+def _write_atomic(path, data):
+    """ Writes data to path so that readers see either old or new content """
+
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+
+    os.replace(tmp, path)
+
+
+class BloomFilter(object):
+    """
+        In-memory Bloom filter over strings.
+        It can answer "definitely not in the set" without touching disk.
+    """
+
+    HEADER = struct.Struct('<qqq') # bits, hashes, capacity
+
+
+    def __init__(self, capacity, error_rate=0.01, bits=None):
+        self.capacity = max(int(capacity), 1)
+
+        self.m = int(math.ceil(
+            -self.capacity * math.log(error_rate) / (math.log(2) ** 2)
+        ))
+        self.k = max(1, int(round(self.m / self.capacity * math.log(2))))
+
+        self.bits = bits if bits is not None else bytearray((self.m + 7) // 8)
+
+
+    def _positions(self, key):
+        digest = _digest(key)
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        for i in range(self.k):
+            yield (h1 + i * h2) % self.m
+
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+
+    def __contains__(self, key):
+        return all(
+            self.bits[pos >> 3] & (1 << (pos & 7))
+            for pos in self._positions(key)
+        )
+
+
+    def save(self, path):
+        _write_atomic(
+            path, self.HEADER.pack(self.m, self.k, self.capacity) + self.bits
+        )
+
+
+    @classmethod
+    def load(cls, path):
+        """
+            Loads the filter saved in path.
+            Raises ValueError if the file is truncated or corrupt.
+        """
+
+        with open(path, 'rb') as f:
+            m, k, capacity = cls.HEADER.unpack(f.read(cls.HEADER.size))
+            bits = bytearray(f.read())
+
+        if m <= 0 or k <= 0 or len(bits) != (m + 7) // 8:
+            raise ValueError('Corrupt Bloom filter in %s' % path)
+
+        bloom = cls(capacity, bits=bits)
+        bloom.m, bloom.k = m, k
+
+        return bloom
+
+
+class EntryIdSet(object):
+    """
+        On-disk hash set of entryids, with a Bloom filter in front.
+
+        Entryids are distributed in NBUCKETS bucket files by their hash,
+        one JSON string per line, so checking an entryid reads
+        at most one bucket, and only if the Bloom filter can't discard it.
+        Adding entryids only appends lines to their buckets.
+    """
+
+    NBUCKETS = 64
+    BUCKET_FILE_FORMAT = "bucket%.2d.txt"
+    BLOOM_FILE = "entryids.bloom"
+    COUNT_FILE = "count.json"
+
+    INITIAL_CAPACITY = 10000
+
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder where to store the set,
+                    usually a subfolder of the feed folder.
+        """
+
+        self.folder = folder
+        self._buckets = {} # cache of loaded buckets
+        self._bloom = None
+        self._count = None
+
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.folder, self.BLOOM_FILE))
+
+
+    @property
+    def bloom(self):
+        if self._bloom is None:
+            try:
+                self._bloom = BloomFilter.load(
+                    os.path.join(self.folder, self.BLOOM_FILE)
+                )
+            except (OSError, struct.error, ValueError):
+                self._bloom = self._rebuild_bloom(
+                    max(self.INITIAL_CAPACITY, 2 * self.count)
+                )
+
+        return self._bloom
+
+
+    @property
+    def count(self):
+        if self._count is None:
+            try:
+                with open(os.path.join(self.folder, self.COUNT_FILE)) as f:
+                    self._count = json.loads(f.read())
+            except (OSError, ValueError):
+                self._count = sum(
+                    len(self._bucket(nbucket))
+                    for nbucket in range(self.NBUCKETS)
+                )
+
+        return self._count
+
+
+    def _nbucket(self, entryid):
+        return _digest(entryid)[0] % self.NBUCKETS
+
+
+    def _bucket_path(self, nbucket):
+        return os.path.join(self.folder, self.BUCKET_FILE_FORMAT % nbucket)
+
+
+    def _bucket(self, nbucket):
+        """ Returns the set of entryids in bucket nbucket """
+
+        if nbucket not in self._buckets:
+            try:
+                with open(self._bucket_path(nbucket)) as f:
+                    self._buckets[nbucket] = {
+                        json.loads(line) for line in f if line.strip()
+                    }
+            except OSError:
+                self._buckets[nbucket] = set()
+
+        return self._buckets[nbucket]
+
+
+    def _rebuild_bloom(self, capacity):
+        bloom = BloomFilter(capacity)
+
+        for nbucket in range(self.NBUCKETS):
+            for entryid in self._bucket(nbucket):
+                bloom.add(entryid)
+
+        return bloom
+
+
+    def __contains__(self, entryid):
+        entryid = str(entryid)
+
+        if entryid not in self.bloom:
+            return False # definitely not in the set
+
+        return entryid in self._bucket(self._nbucket(entryid))
+
+
+    def add(self, entryids):
+        """ Adds all entryids in the iterable that weren't already there """
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        count = self.count
+
+        new = {}
+        for entryid in map(str, entryids):
+            if entryid not in self:
+                nbucket = self._nbucket(entryid)
+
+                self._bucket(nbucket).add(entryid)
+                new.setdefault(nbucket, []).append(entryid)
+                self.bloom.add(entryid)
+
+        if not new:
+            return
+
+        for nbucket, l in new.items():
+            with open(self._bucket_path(nbucket), 'a') as f:
+                f.write(''.join(json.dumps(entryid) + '\n' for entryid in l))
+
+        self._count = count + sum(len(l) for l in new.values())
+
+        if self._count > self.bloom.capacity:
+            # Too many entryids for the current error rate; grow it
+            self._bloom = self._rebuild_bloom(2 * self._count)
+
+        self.bloom.save(os.path.join(self.folder, self.BLOOM_FILE))
+
+        _write_atomic(
+            os.path.join(self.folder, self.COUNT_FILE),
+            json.dumps(self._count).encode('utf-8')
+        )
@@ -1,8 +1,23 @@
 # -*- coding: utf-8 -*-
 # Author: Álvaro Parafita (parafita.alvaro@gmail.com)
 
+import re
 import os.path
 import json
+import hashlib
+import threading
+import urllib.error
+import urllib.request
+
+from array import array
+from bisect import bisect_left
+from itertools import islice
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None # no locks between processes (only between threads)
 
 from . import __version__, __url__
 
@@ -14,11 +29,144 @@ fp.USER_AGENT = "newsparser/{version} +{url}".format(
 )
 
 from .entry import Entry
+from .entryids import EntryIdSet
+from .columns import FeedColumns
+from .changes import changelog
+from .stats import FeedStats
 from . import exceptions
 
 import logging
 
 
+_locks = {}
+_locks_lock = threading.Lock()
+
+def _feed_lock(folder, name, kind='write'):
+    """ Returns a process-wide Lock for the given feed and kind of lock """
+
+    key = (os.path.abspath(os.path.join(folder, name)), kind)
+
+    with _locks_lock:
+        if key not in _locks:
+            _locks[key] = threading.Lock()
+
+        return _locks[key]
+
+
+@contextmanager
+def _feed_flock(folder, name, kind='write', blocking=True):
+    """
+        Context manager that holds the process-wide lock of the feed
+        (see _feed_lock) and an flock on its {kind}.lock file,
+        so that other processes using the same feed wait too.
+        Yields whether the lock was acquired, that is always True
+        unless blocking is False and someone else holds it.
+    """
+
+    lock = _feed_lock(folder, name, kind)
+    if not lock.acquire(blocking):
+        yield False
+        return
+
+    try:
+        if fcntl is None:
+            yield True
+            return
+
+        with open(os.path.join(folder, name, kind + '.lock'), 'ab') as f:
+            try:
+                fcntl.flock(
+                    f, fcntl.LOCK_EX if blocking else \
+                        fcntl.LOCK_EX | fcntl.LOCK_NB
+                )
+            except BlockingIOError:
+                yield False
+                return
+
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    finally:
+        lock.release()
+
+
+def parse_feed(link, etag=None, modified=None, timeout=None):
+    """
+        Returns the feed in link parsed by feedparser, as fp.parse(link) does,
+        but aborting the request if it takes more than timeout seconds
+        (feedparser itself doesn't accept a timeout).
+        Raises OSError (e.g. URLError, timeout) if the request fails
+        without an HTTP status.
+    """
+
+    if timeout is None:
+        return fp.parse(link, etag=etag, modified=modified)
+
+    request = urllib.request.Request(link, headers={
+        'User-Agent': fp.USER_AGENT,
+        'Accept': getattr(fp, 'ACCEPT_HEADER', '*/*')
+    })
+
+    if etag:
+        request.add_header('If-None-Match', etag)
+    if modified:
+        request.add_header('If-Modified-Since', modified)
+
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = response.read()
+            status, href = response.status, response.geturl()
+            headers = { k.lower(): v for k, v in response.headers.items() }
+
+    except urllib.error.HTTPError as e:
+        # Not modified, or an error status; there's nothing to parse
+        feed = fp.FeedParserDict(bozo=0, entries=[])
+        feed['status'] = e.code
+        feed['href'] = link
+
+        return feed
+
+    feed = fp.parse(data, response_headers=headers)
+
+    feed['status'] = status
+    feed['href'] = href
+    feed['etag'] = headers.get('etag')
+    feed['modified'] = headers.get('last-modified')
+
+    return feed
+
+
+def _write_atomic(path, data):
+    """
+        Writes data to path so that readers see either old or new content.
+        Returns the os.stat_result of the written file.
+    """
+
+    # Unique, since other threads or processes may be writing it too
+    tmp = '%s.%d.%d.tmp' % (path, os.getpid(), threading.get_ident())
+    with open(tmp, 'wb') as f:
+        f.write(data)
+        f.flush()
+
+        st = os.fstat(f.fileno())
+
+    os.replace(tmp, path)
+
+    return st
+
+
+def _chunk_id(st):
+    """
+        Returns the header of the sidecar index of a chunk
+        with os.stat_result st: its size, inode and mtime in ns,
+        so that an index is never used with a chunk it wasn't built for.
+    """
+
+    return array('q', [st.st_size, st.st_ino % 2 ** 63, st.st_mtime_ns])
+
+
 class Feed(object):
     """
         Class that stores metadata from feeds and its entries.
@@ -28,6 +176,13 @@ class Feed(object):
 
     ENTRIES_PER_FILE = 1000
     ENTRIES_METADATA_FILE_FORMAT = "entries%.5d.json"
+    ENTRIES_INDEX_FILE_FORMAT = "entries%.5d.idx"
+    ENTRIES_LOG_FILE_FORMAT = "log%.5d.jsonl"
+    ENTRIES_LOG_FILE_REGEX = re.compile(r'log(\d+)\.jsonl')
+    ENTRIES_LOG_INDEX_FILE_FORMAT = "log%.5d.idx"
+    LOG_MAX_SIZE = 2 ** 23 # bytes before compacting the log
+    ENTRYIDS_FOLDER = "entryids"
+    COLUMNS_FOLDER = "columns"
 
 
     def __init__(self, folder, name, link=None, metadata=None):
@@ -61,6 +216,89 @@ class Feed(object):
         self.num_entries = metadata.get('num_entries', 0)
         self.active = metadata.get('active', True)
 
+        # Polling history, maintained by the scheduler module
+        self.polling = metadata.get('polling', {})
+
+        self._entryids = None
+        self._columns = None
+        self._stats = None
+
+        self._log_cache = {} # {nsegment: (index size, covered, positions)}
+        self._log_view = None
+
+
+    @property
+    def entryids(self):
+        """
+            EntryIdSet with the entryids of all the entries in this feed.
+            Feeds that don't have it yet get it built from their entries.
+        """
+
+        if self._entryids is None:
+            self._entryids = EntryIdSet(
+                os.path.join(self.folder, self.name, self.ENTRYIDS_FOLDER)
+            )
+
+            if not self._entryids.exists():
+                self._entryids.add(
+                    e.entryid for e in self.iter_entries() if e.entryid
+                )
+
+        return self._entryids
+
+
+    @property
+    def columns(self):
+        """
+            FeedColumns with the metadata of this feed in columnar format,
+            built the first time it is requested.
+            Returns None if numpy is not available.
+        """
+
+        if self._columns is None:
+            try:
+                columns = FeedColumns(
+                    os.path.join(self.folder, self.name, self.COLUMNS_FOLDER)
+                )
+            except ImportError:
+                return None
+
+            if not columns.exists():
+                with _feed_flock(self.folder, self.name, 'columns'):
+                    if not columns.exists():
+                        entries = self.iter_entries()
+                        batch = list(islice(entries, self.ENTRIES_PER_FILE))
+
+                        while batch:
+                            columns.update(batch)
+                            batch = list(
+                                islice(entries, self.ENTRIES_PER_FILE)
+                            )
+
+            self._columns = columns
+
+        return self._columns
+
+
+    @property
+    def stats(self):
+        """
+            FeedStats with aggregate counters of the entries of this feed
+            (see FeedStats.get), built the first time it is requested.
+        """
+
+        if self._stats is None:
+            stats = FeedStats(os.path.join(self.folder, self.name))
+
+            if not stats.exists():
+                with _feed_flock(self.folder, self.name, 'stats'):
+                    if not stats.exists():
+                        stats.rebuild(self.iter_entries())
+
+            self._stats = stats
+
+        return self._stats
+
 
     def get_metadata(self):
         """
@@ -74,7 +312,8 @@ class Feed(object):
             'modified': self.modified,
             'language': self.language,
             'num_entries': self.num_entries,
-            'active': self.active
+            'active': self.active,
+            'polling': self.polling
         }
         
 
@@ -87,11 +326,16 @@ class Feed(object):
             f.write(json.dumps(self.get_metadata(), indent=2))
 
 
-    def update(self):
+    def update(self, timeout=None):
         """
             Called whenever we want to parse the RSS feed again.
             Updates metadata from the feed and gets new entries.
             Stores all the data in the respective json files.
+            If timeout is given, the request is aborted after timeout seconds
+            and the feed is left as it was, to be polled again later.
+
+            Returns the number of new entries (0 if the feed wasn't modified)
+            or None if the feed couldn't be polled.
         """
 
         if not self.active:
@@ -101,7 +345,17 @@ class Feed(object):
             return
 
         # Try retrieving the feed
-        feed = fp.parse(self.link, etag=self.etag, modified=self.modified)
+        try:
+            feed = parse_feed(
+                self.link, etag=self.etag, modified=self.modified,
+                timeout=timeout
+            )
+        except OSError as e:
+            # Timeout or connection error. We'll try later
+            logging.warning('Feed "{name}" couldn\'t be retrieved: {e}'.format(
+                name=self.name, e=e
+            ))
+            return
 
         if feed.get('bozo', 0):
             # There's been an error in the parsing of the XML feed
@@ -112,9 +366,9 @@ class Feed(object):
         status = feed.get('status', 500)
 
         if status == 304:
-            # Not modified. Don't do anything else
+            # Not modified. Don't do anything else
             logging.info('Feed "{name}" not modified'.format(name=self.name))
-            return
+            return 0
 
         elif 300 <= status and status < 400:
             # Consider redirects to another location
@@ -151,10 +405,13 @@ class Feed(object):
         self.link = feed.get('href', self.link)
         self.language = feed.get('language')
 
-        # Retrieve new entries, asign them an index and put them in the list
-        self.save_entries(self.new_entries(feed))
+        # Retrieve new entries, asign them an index and put them in the list
+        entries = self.new_entries(feed)
+        self.save_entries(entries)
         self.save_metadata()
 
+        return len(entries)
+
 
     def new_entries(self, feed):
         """
@@ -186,18 +443,10 @@ class Feed(object):
             entries[str(entry_json['entryid'])] = entry_json
 
         # Get only new entries
-        # Retrieve the set of all entryids
-        entryids = {
-            e.entryid
-            for e in self.get_entries()
-            if e.entryid
-        }
-
         entries = [
-            entries[ids]
-            for ids in (
-                set(entries.keys()) - entryids
-            )
+            entry
+            for ids, entry in entries.items()
+            if ids not in self.entryids
         ]
 
         for i, entry in enumerate(sorted(entries, key=lambda e: e['index'])):
@@ -212,82 +461,213 @@ class Feed(object):
         """
             Saves current state of passed entries, 
             locating them according to their index value.
-        """
 
-        getnfile = lambda x: int(x / Feed.ENTRIES_PER_FILE) # utility function
+            Entries are appended to the feed log, so saving never rewrites
+            a chunk; whenever the log grows over LOG_MAX_SIZE,
+            it is folded back into the chunks by a background compaction.
+            Every saved entry is also recorded in the corpus changelog.
+
+            Entries whose metadata is the same as the stored one
+            are skipped, so saving a whole feed after changing
+            a few entries only writes (and records) those.
+        """
 
         entries = sorted(entries, key=lambda entry: entry.index)
 
-        i = 0
-        new_num_entries = max(
-            self.num_entries, 
-            max( [ x.index for x in entries ] or [-1] ) + 1
-        )
+        if not entries:
+            return
 
-        while i < len(entries):
-            nfile = getnfile(entries[i].index)
+        # Other processes may be saving or compacting this feed too
+        with _feed_flock(self.folder, self.name):
+            stored = self._stored_records([ e.index for e in entries ])
 
-            # Get all entries from passed entries that belong to the same file
-            j = i + 1
-            while j < len(entries) and getnfile(entries[j].index) == nfile:
-                j += 1
+            changed = []
+            lines = []
+            for e in entries:
+                line = self._changed_record(e, stored.get(e.index))
 
-            # Use those indexes to get the entries located in the same file
-            block_entries = entries[i:j]
+                if line is not None:
+                    changed.append(e)
+                    lines.append(line)
 
-            # Get all entries from this file
-            file_entries = self.get_entries(
-                nfile * Feed.ENTRIES_PER_FILE,
-                (nfile + 1) * Feed.ENTRIES_PER_FILE
-            )
+            entries = changed
+            if not entries:
+                return
 
-            # Replace all entries belonging to that file
-            k = 0
-            for l in range(Feed.ENTRIES_PER_FILE):
-                if k < len(block_entries):
-                    # More entries to add or replace
-                    if l < len(file_entries):
-                        if block_entries[k].index < file_entries[l].index:
-                            file_entries.insert(l, block_entries[k])
-                            k += 1
-                        elif block_entries[k].index == file_entries[l].index:
-                            # Replace
-                            file_entries[l] = block_entries[k]
-                            k += 1
-                        else:
-                            # Nothing to add before this, nor to replace. 
-                            continue
-                    else:
-                        # Nothing more to check on. So add what remains
-                        file_entries += block_entries[k:]
-                        break
-                else:
-                    # Nothing more to add or replace, so leave it like it is now
-                    break
-
-            # Save file
-            file_result = json.dumps(
-                [e.get_metadata() for e in file_entries], 
-                indent=2
+            log_size = self._append_log(
+                self._last_log_segment(),
+                [ e.index for e in entries ], lines
             )
 
-            # Avoid KeyboardInterrupt
-            while True:
-                try:    
-                    with open(os.path.join(
-                        self.folder,
-                        self.name,
-                        self.ENTRIES_METADATA_FILE_FORMAT % (nfile)
-                    ), 'w') as f:
-                        f.write(file_result)
+            # Recorded while holding the lock, so that the changelog
+            # orders the saves of this feed as the log does
+            changelog(self.folder).record(self.name, [
+                (e.index, 'new' if e.index >= self.num_entries else 'update')
+                for e in entries
+            ])
 
-                    break
-                except KeyboardInterrupt:
-                    pass
+        # Entries beyond num_entries are new, so their entryids must be added
+        new_entryids = [
+            e.entryid
+            for e in entries
+            if e.index >= self.num_entries and e.entryid
+        ]
 
-            i = j
+        new_num_entries = max(self.num_entries, entries[-1].index + 1)
 
+        self.entryids.add(new_entryids)
         self.num_entries = new_num_entries
+
+        if self._columns is not None or os.path.exists(
+            os.path.join(self.folder, self.name, self.COLUMNS_FOLDER)
+        ):
+            # Only keep columns in sync for feeds that use them
+            columns = self.columns
+            if columns is not None:
+                with _feed_flock(self.folder, self.name, 'columns'):
+                    columns.update(entries)
+
+        stats = self.stats
+        with _feed_flock(self.folder, self.name, 'stats'):
+            stats.update(entries)
+
+        if log_size > self.LOG_MAX_SIZE:
+            self.compact(background=True)
+
+
+    def _stored_records(self, indexes):
+        """
+            Returns a dict {index: record} with the stored records
+            of the given sorted indexes, reading only the chunks
+            (and the spans of them) where they are.
+        """
+
+        by_file = {}
+        for index in indexes:
+            if index < self.num_entries:
+                nfile = int(index / Feed.ENTRIES_PER_FILE)
+                by_file.setdefault(nfile, []).append(index)
+
+        wanted = set(indexes)
+
+        return {
+            index: record
+            for file_indexes in by_file.values()
+            for index, record in self.iter_records(
+                file_indexes[0], file_indexes[-1] + 1
+            )
+            if index in wanted
+        }
+
+
+    def _changed_record(self, entry, stored):
+        """
+            Returns the record to save for entry, given its stored record
+            (None if there's none), or None if it didn't change.
+        """
+
+        if stored is not None and entry._fields is None and \
+                entry._raw == stored:
+            return None # never decoded, so never modified
+
+        line = json.dumps(entry.get_metadata()).encode('utf-8')
+
+        if stored is None:
+            return line
+
+        # Log records are stored as line, and chunk records indented,
+        # unless they were written by older versions
+        if stored == line or stored == json.dumps(
+            entry.get_metadata(), indent=2
+        ).encode('utf-8'):
+            return None
+
+        try:
+            if json.loads(stored.decode('utf-8')) == entry.get_metadata():
+                return None
+        except ValueError:
+            pass # broken record; replace it
+
+        return line
+
+
+    def compact(self, background=False):
+        """
+            Folds all the feed log into the chunks of entries.
+            New saves go to a new log segment meanwhile,
+            so this can be executed in a background thread.
+            If background, returns the Thread where compaction is running.
+        """
+
+        if background:
+            thread = threading.Thread(target=self.compact)
+            thread.start()
+
+            return thread
+
+        with _feed_flock(
+            self.folder, self.name, 'compaction', blocking=False
+        ) as acquired:
+            if not acquired:
+                return # someone else, maybe another process, is compacting it
+
+            # Rotate the log: from now on, saves go to a new segment.
+            # Savers append while holding the write lock (in any process),
+            # so no one writes to the closed segments once we release it
+            with _feed_flock(self.folder, self.name):
+                segments = self._log_segments()
+
+                if not segments:
+                    return
+
+                open(self._log_path(segments[-1] + 1), 'ab').close()
+                open(self._log_index_path(segments[-1] + 1), 'wb').close()
+
+            # Merge all closed segments, last writer wins
+            positions = {}
+            for nsegment in segments:
+                for index, (offset, length) in \
+                        self._read_log_segment(nsegment)[1].items():
+                    positions[index] = (nsegment, offset, length)
+
+            log = self._read_log_records(positions.items())
+
+            getnfile = lambda x: int(x / Feed.ENTRIES_PER_FILE) # utility function
+
+            by_file = {}
+            for index, record in log.items():
+                by_file.setdefault(getnfile(index), {})[index] = record
+
+            for nfile, block in sorted(by_file.items()):
+                file_records = dict(self._read_records(nfile))
+
+                for index, record in block.items():
+                    # Chunk records are stored indented, as they used to
+                    file_records[index] = json.dumps(
+                        json.loads(record.decode('utf-8')), indent=2
+                    ).encode('utf-8')
+
+                self._write_chunk(nfile, sorted(file_records.items()))
+
+            # Chunks already contain these segments, so readers
+            # can safely stop seeing them
+            for nsegment in segments:
+                os.remove(self._log_path(nsegment))
+                self._log_cache.pop(nsegment, None)
+
+                try:
+                    os.remove(self._log_index_path(nsegment))
+                except OSError:
+                    pass # logs written before they had indexes
+
+            # Drop the titles that were replaced since the last compaction
+            if os.path.exists(
+                os.path.join(self.folder, self.name, self.COLUMNS_FOLDER)
+            ):
+                columns = self.columns
+                if columns is not None:
+                    with _feed_flock(self.folder, self.name, 'columns'):
+                        columns.compact()
         
 
     def get_entries(self, low=None, high=None):
@@ -295,61 +675,547 @@ class Feed(object):
             Returns list with metadata from entries[low:high]
         """
 
+        return list(self.iter_entries(low, high))
+
+
+    def iter_entries(self, low=None, high=None, predicate=None):
+        """
+            Generator of the entries in entries[low:high].
+            Reads one chunk at a time, so memory use doesn't depend 
+            on the number of entries in the feed.
+            If predicate is given, only entries for which 
+            predicate(entry) is True are yielded.
+        """
+
+        for index, record in self.iter_records(low, high):
+            # Records are decoded lazily by Entry, when needed
+            entry = Entry(self.folder, self.name, record=record, index=index)
+
+            if predicate is None or predicate(entry):
+                yield entry
+
+
+    def iter_records(self, low=None, high=None):
+        """
+            Generator of (index, record) of the entries in entries[low:high],
+            record being the bytes of the JSON-encoded metadata of the entry,
+            as stored, without decoding it.
+        """
+
+        low, high = self._bounds(low, high)
+
+        if low >= high: 
+            # Avoid trivial cases
+            return
+
+        log, log_indexes = self._read_log()
+
+        for nfile in range(*self._chunk_range(low, high)):
+            file_low = max(low, nfile * Feed.ENTRIES_PER_FILE)
+            file_high = min(high, (nfile + 1) * Feed.ENTRIES_PER_FILE)
+
+            i = bisect_left(log_indexes, file_low)
+            j = bisect_left(log_indexes, file_high, i)
+
+            # Read the log before the chunk: compaction writes chunks
+            # before removing log segments, so we never miss a record
+            newer = self._read_log_records(
+                (index, log[index]) for index in log_indexes[i:j]
+            )
+
+            records = self._read_records(nfile, file_low, file_high)
+
+            if newer:
+                # Log records are more recent than chunk records
+                records = dict(records)
+                records.update(newer)
+
+                records = sorted(records.items())
+
+            yield from records
+
+
+    def version(self, low=None, high=None):
+        """
+            Returns (version, mtime) of entries[low:high], where version
+            is a string that changes whenever any of those entries changes
+            and mtime is the last modification time of their files.
+
+            Only the sizes and modification times of the files
+            are checked, so this is much cheaper than reading the entries.
+        """
+
+        low, high = self._bounds(low, high)
+
+        paths = [
+            self._chunk_path(nfile)
+            for nfile in range(*self._chunk_range(low, high))
+        ]
+        paths.extend(map(self._log_path, self._log_segments()))
+
+        h = hashlib.md5(('%s|%d|%d' % (self.name, low, high)).encode('utf-8'))
+        mtime = 0
+
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError:
+                h.update(b'-')
+                continue
+
+            h.update(('%s|%d|%d;' % (
+                os.path.basename(path), st.st_size, st.st_mtime_ns
+            )).encode('utf-8'))
+
+            mtime = max(mtime, st.st_mtime)
+
+        return h.hexdigest(), mtime
+
+
+    def _bounds(self, low, high):
+        """ Returns the actual (low, high) for entries[low:high] """
+
         if low is None:
             low = 0
 
         if high is None:
             high = self.num_entries
 
-        # Consider the python negative notation for indexes
+        # Consider the python negative notation for indexes
         if low < 0:
             low = (low % self.num_entries) if self.num_entries else 0
         if high < 0:
             high = (high % self.num_entries) if self.num_entries else 0
 
-        if low >= high: 
-            # Avoid trivial cases
-            return []
+        return low, high
+
+
+    def _chunk_range(self, low, high):
+        """ Returns the range of chunks with entries[low:high] """
+
+        if low >= high:
+            return 0, 0
+
+        return (
+            int(low / Feed.ENTRIES_PER_FILE),
+            int((high-1) / Feed.ENTRIES_PER_FILE) + 1
+        )
+
+
+    def _chunk_path(self, nfile):
+        return os.path.join(
+            self.folder, self.name, self.ENTRIES_METADATA_FILE_FORMAT % nfile
+        )
+
+
+    def _index_path(self, nfile):
+        return os.path.join(
+            self.folder, self.name, self.ENTRIES_INDEX_FILE_FORMAT % nfile
+        )
+
+
+    def _log_path(self, nsegment):
+        return os.path.join(
+            self.folder, self.name, self.ENTRIES_LOG_FILE_FORMAT % nsegment
+        )
+
+
+    def _log_index_path(self, nsegment):
+        return os.path.join(
+            self.folder, self.name,
+            self.ENTRIES_LOG_INDEX_FILE_FORMAT % nsegment
+        )
+
+
+    def _log_segments(self):
+        """ Returns the sorted list of log segment numbers of this feed """
+
+        return sorted(
+            int(m.group(1))
+            for m in map(
+                self.ENTRIES_LOG_FILE_REGEX.fullmatch,
+                os.listdir(os.path.join(self.folder, self.name))
+            )
+            if m
+        )
+
+
+    def _last_log_segment(self):
+        return (self._log_segments() or [0])[-1]
+
+
+    def _append_log(self, nsegment, indexes, lines):
+        """
+            Appends lines, the records of the entries with the given indexes,
+            to log segment nsegment, and their positions to its sidecar index.
+            Must be called with the write lock of the feed.
+            Returns the size of the segment afterwards.
+
+            The sidecar index stores the positions as an array of int64:
+            [index0, offset0, length0, index1, offset1, ...],
+            so that readers know which entries are in the log
+            without decoding its records.
+        """
 
-        entries = []
-        lowfile = int(low / Feed.ENTRIES_PER_FILE)
-        highfile = int((high-1) / Feed.ENTRIES_PER_FILE)
+        path = self._log_path(nsegment)
 
-        for nfile in range(lowfile, highfile + 1):
+        # Lines of interrupted saves, or of logs without index
+        self._index_log(nsegment)
+
+        data = b''.join(line + b'\n' for line in lines)
+
+        # Avoid KeyboardInterrupt
+        partial = False
+        while True:
             try:
-                # Exceptions could occur trying to access files that didn't exist
-                # because you asked for entry index that is higher than the highest.
-                # In that case, an Exception will be raised, 
-                # and we will return only what we found
-                with open(os.path.join(
-                        self.folder, self.name, 
-                        self.ENTRIES_METADATA_FILE_FORMAT % nfile
-                    )) as f:
-                    j = [ Entry(self.folder, self.name, d) for d in json.loads(f.read()) ]
-            except:
-                # File doesn't exist, so nothing will be added to entries
-                j = []
+                with open(path, 'ab') as f:
+                    start = f.tell()
 
-            entries += j
+                    if partial:
+                        # A previous try wrote a partial line;
+                        # isolate it in its own (invalid) line
+                        f.write(b'\n')
+                        start += 1
+
+                    f.write(data)
 
-        # Get low level
-        i = 0
-        while i < len(entries):
-            if entries[i].index >= low:
                 break
+            except KeyboardInterrupt:
+                partial = True
+
+        positions = array('q')
+        for index, line in zip(indexes, lines):
+            positions.extend((index, start, len(line)))
+            start += len(line) + 1
+
+        with open(self._log_index_path(nsegment), 'ab') as f:
+            f.write(positions.tobytes())
+
+        return start
+
+
+    def _index_log(self, nsegment):
+        """
+            Adds to the sidecar index of log segment nsegment
+            the lines that it doesn't cover: those of a save interrupted
+            between writing the log and its index,
+            or all of them if the log was written before indexes existed.
+            Must be called with the write lock of the feed.
+        """
+
+        with open(self._log_index_path(nsegment), 'ab+') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+
+            item = array('q').itemsize * 3
+            if size % item:
+                size -= size % item
+                f.truncate(size) # drop a partially written position
+
+            covered = 0
+            if size:
+                f.seek(size - item)
+
+                last = array('q')
+                last.frombytes(f.read(item))
+                covered = last[1] + last[2] + 1
+
+            positions, _ = self._log_tail(nsegment, covered)
+
+            if positions:
+                f.write(array(
+                    'q', (x for position in positions for x in position)
+                ).tobytes())
+
+
+    def _log_tail(self, nsegment, covered):
+        """
+            Returns ([(index, offset, length)], end) of the complete lines
+            of log segment nsegment from byte covered on,
+            decoding them to know their indexes,
+            end being the byte where the last of them ends.
+        """
+
+        try:
+            with open(self._log_path(nsegment), 'rb') as f:
+                f.seek(covered)
+                data = f.read()
+        except OSError:
+            # Removed by a compaction; its records are in the chunks by now
+            return [], covered
+
+        # Ignore the last line if it's still being written
+        end = data.rfind(b'\n') + 1
+
+        positions = []
+        offset = covered
+
+        for line in data[:end].split(b'\n')[:-1]:
+            try:
+                index = int(json.loads(line.decode('utf-8'))['index'])
+            except (ValueError, KeyError, TypeError):
+                pass # empty or broken line
             else:
-                i += 1
+                positions.append((index, offset, len(line)))
+
+            offset += len(line) + 1
+
+        return positions, covered + end
+
+
+    def _read_log_segment(self, nsegment):
+        """
+            Returns (version, positions) of log segment nsegment,
+            where positions is a dict {index: (offset, length)}
+            with the last record for each index, read from its sidecar index,
+            and version changes whenever the segment does.
+            Segments are only appended to, so previous reads are cached
+            and only the new positions are read.
+        """
+
+        size, covered, positions = self._log_cache.get(nsegment, (0, 0, {}))
+
+        try:
+            with open(self._log_index_path(nsegment), 'rb') as f:
+                f.seek(size)
+                data = f.read()
+        except OSError:
+            data = b''
+
+        # Ignore the last position if it's still being written
+        item = array('q').itemsize * 3
+        data = data[:len(data) - len(data) % item]
+
+        if data:
+            new = array('q')
+            new.frombytes(data)
+
+            positions = dict(positions)
+            for k in range(0, len(new), 3):
+                positions[new[k]] = (new[k + 1], new[k + 2])
+
+            size += len(data)
+            covered = new[-2] + new[-1] + 1
+
+            self._log_cache[nsegment] = (size, covered, positions)
+
+        # Lines not in the index yet (see _index_log)
+        tail, end = self._log_tail(nsegment, covered)
+
+        if tail:
+            positions = dict(positions)
+            for index, offset, length in tail:
+                positions[index] = (offset, length)
+
+        return (size, end), positions
+
+
+    def _read_log(self):
+        """
+            Returns the merged view of the feed log as a dict
+            {index: (nsegment, offset, length)} with the position
+            of the last record of each index, and the sorted list of indexes.
+        """
+
+        segments = self._log_segments()
+
+        for nsegment in list(self._log_cache):
+            if nsegment not in segments:
+                self._log_cache.pop(nsegment, None)
+
+        views = [
+            (nsegment,) + self._read_log_segment(nsegment)
+            for nsegment in segments
+        ]
+
+        key = tuple((nsegment, version) for nsegment, version, _ in views)
+
+        if self._log_view is None or self._log_view[0] != key:
+            log = {}
+            for nsegment, _, positions in views:
+                for index, (offset, length) in positions.items():
+                    log[index] = (nsegment, offset, length)
+
+            self._log_view = (key, log, sorted(log))
+
+        return self._log_view[1:]
+
+
+    def _read_log_records(self, positions):
+        """
+            Returns a dict {index: record} with the log records
+            in positions, an iterable of (index, (nsegment, offset, length)),
+            reading only the spans of the segments with those records.
+            Records of segments removed by a compaction meanwhile
+            are left out; the chunks have them by now.
+        """
+
+        by_segment = {}
+        for index, (nsegment, offset, length) in positions:
+            by_segment.setdefault(nsegment, []).append((offset, length, index))
+
+        records = {}
+        for nsegment, items in by_segment.items():
+            try:
+                f = open(self._log_path(nsegment), 'rb')
+            except OSError:
+                continue
+
+            items.sort()
+            start = items[0][0]
+            end = max(offset + length for offset, length, _ in items)
+
+            with f:
+                f.seek(start)
+                span = f.read(end - start)
+
+            for offset, length, index in items:
+                records[index] = span[offset - start:offset - start + length]
+
+        return records
+
+
+    def _write_chunk(self, nfile, records):
+        """
+            Writes the given records, a list of (index, record) 
+            sorted by index, as chunk nfile, along with its sidecar index.
+
+            The chunk is still a JSON list, but each record is serialized
+            on its own so that we know its byte offset and length.
+            The sidecar index stores them as an array of int64:
+            [chunk size, chunk inode, chunk mtime (ns),
+             index0, offset0, length0, index1, offset1, ...]
+            where the header identifies the chunk file (see _chunk_id).
+
+            Both files are replaced atomically, so readers always find
+            either the old or the new version of the chunk.
+        """
+
+        chunk = bytearray(b'[\n')
+        index = array('q')
+
+        for n, (i, record) in enumerate(records):
+            if n:
+                chunk += b',\n'
+
+            index.extend((i, len(chunk), len(record)))
+            chunk += record
+
+        chunk += b'\n]'
+
+        # Avoid KeyboardInterrupt
+        while True:
+            try:
+                st = _write_atomic(self._chunk_path(nfile), chunk)
+                _write_atomic(
+                    self._index_path(nfile), (_chunk_id(st) + index).tobytes()
+                )
 
-        # Get high level
-        j = len(entries) - 1
-        while j >= 0:
-            if entries[j].index < high:
-                j += 1
                 break
-            else:
-                j -= 1
+            except KeyboardInterrupt:
+                pass
 
-        return entries[i:j]
+
+    def _load_index(self, nfile, f):
+        """
+            Returns the sidecar index of chunk nfile, given its open file f,
+            as three arrays (indexes, offsets, lengths), sorted by index.
+            If the index doesn't exist or is stale, it is rebuilt.
+        """
+
+        header = _chunk_id(os.fstat(f.fileno()))
+
+        index = array('q')
+        try:
+            with open(self._index_path(nfile), 'rb') as fi:
+                index.frombytes(fi.read())
+        except (OSError, ValueError):
+            index = array('q')
+
+        if len(index) % 3 or index[:3] != header:
+            # Chunk written without index (or replaced since); rebuild it
+            index = self._build_index(nfile, f)
+
+        return index[3::3], index[4::3], index[5::3]
+
+
+    def _build_index(self, nfile, f):
+        """
+            Builds and saves the sidecar index of chunk nfile,
+            given its open file f, scanning its records one by one.
+        """
+
+        f.seek(0)
+        chunk = f.read()
+
+        text = chunk.decode('utf-8')
+
+        if len(text) == len(chunk):
+            byte_offset = lambda pos: pos
+        else:
+            # Non-ascii content; offsets need to be computed in bytes
+            byte_offset = lambda pos: len(text[:pos].encode('utf-8'))
+
+        decoder = json.JSONDecoder()
+        index = _chunk_id(os.fstat(f.fileno()))
+
+        pos = text.find('[') + 1
+        while pos:
+            while pos < len(text) and text[pos] in ' \t\r\n,':
+                pos += 1
+
+            if pos >= len(text) or text[pos] == ']':
+                break
+
+            d, end = decoder.raw_decode(text, pos)
+
+            start = byte_offset(pos)
+            index.extend((int(d['index']), start, byte_offset(end) - start))
+
+            pos = end
+
+        _write_atomic(self._index_path(nfile), index.tobytes())
+
+        return index
+
+
+    def _read_records(self, nfile, low=None, high=None):
+        """
+            Returns the records of chunk nfile whose index is in [low, high)
+            as a list of (index, record), reading only the records needed.
+        """
+
+        try:
+            f = open(self._chunk_path(nfile), 'rb')
+        except OSError:
+            # File doesn't exist, so nothing will be added to entries
+            return []
+
+        with f:
+            indexes, offsets, lengths = self._load_index(nfile, f)
+
+            i = bisect_left(indexes, low) if low is not None else 0
+            j = bisect_left(indexes, high, i) \
+                if high is not None else len(indexes)
+
+            if i >= j:
+                return []
+
+            # Records are contiguous in the file, so read the span at once
+            start = offsets[i]
+            end = offsets[j - 1] + lengths[j - 1]
+
+            f.seek(start)
+            span = f.read(end - start)
+
+        return [
+            (
+                indexes[k], 
+                span[offsets[k] - start:offsets[k] - start + lengths[k]]
+            )
+
+            for k in range(i, j)
+        ]
 
 
     def __str__(self):
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class PendingQueue, the persistent queue of entries
+    whose content couldn't be downloaded.
+
+    Entry keeps it up to date: a failed download adds the entry
+    (or increases its attempts) and a successful one removes it.
+    Every failure doubles the time until the next attempt,
+    from BASE_DELAY up to MAX_DELAY, and entries that failed
+    MAX_ATTEMPTS times are given up (kept, but never due again).
+
+    Retry passes (see updater.retry_pending) only ask for the due entries,
+    so they don't need to scan the corpus.
+"""
+
+import os
+import os.path
+import time
+import sqlite3
+import threading
+
+
+_queues = {}
+_queues_lock = threading.Lock()
+
+
+def pending_queue(folder):
+    """ Returns the process-wide PendingQueue of the corpus in folder """
+
+    key = os.path.abspath(folder)
+
+    with _queues_lock:
+        if key not in _queues:
+            _queues[key] = PendingQueue(folder)
+
+        return _queues[key]
+
+
+class PendingQueue(object):
+
+    QUEUE_FILE = 'pending.sqlite'
+
+    BASE_DELAY = 60 * 60 # seconds until the first retry
+    MAX_DELAY = 30 * 24 * 60 * 60
+    MAX_ATTEMPTS = 10
+
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder of the corpus, where feeds.json is
+        """
+
+        self.folder = folder
+        self.path = os.path.join(folder, self.QUEUE_FILE)
+
+        self._lock = threading.Lock()
+        self._connection = None
+
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            if not os.path.exists(self.folder):
+                os.makedirs(self.folder)
+
+            # Entries fail in downloader threads; they share the connection
+            connection = sqlite3.connect(
+                self.path, timeout=60, check_same_thread=False
+            )
+
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS pending ('
+                    'feed TEXT NOT NULL, '
+                    'idx INTEGER NOT NULL, '
+                    'attempts INTEGER NOT NULL, '
+                    'last_attempt REAL NOT NULL, '
+                    'next_attempt REAL, ' # NULL if given up
+                    'PRIMARY KEY (feed, idx))'
+                )
+                connection.execute(
+                    'CREATE INDEX IF NOT EXISTS pending_due '
+                    'ON pending (next_attempt)'
+                )
+
+            self._connection = connection
+
+        return self._connection
+
+
+    def delay(self, attempts):
+        """ Returns the seconds to wait after the given number of failures """
+        return min(self.BASE_DELAY * 2 ** (attempts - 1), self.MAX_DELAY)
+
+
+    def failed(self, feedname, index, now=None):
+        """ Records a failed download of entry index of feed feedname """
+
+        if now is None:
+            now = time.time()
+
+        with self._lock, self.connection as c:
+            row = c.execute(
+                'SELECT attempts FROM pending WHERE feed = ? AND idx = ?',
+                (feedname, index)
+            ).fetchone()
+
+            attempts = (row[0] if row else 0) + 1
+            next_attempt = None if attempts >= self.MAX_ATTEMPTS else \
+                now + self.delay(attempts)
+
+            c.execute(
+                'INSERT OR REPLACE INTO pending '
+                '(feed, idx, attempts, last_attempt, next_attempt) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (feedname, index, attempts, now, next_attempt)
+            )
+
+
+    def succeeded(self, feedname, index):
+        """ Removes entry index of feed feedname from the queue """
+
+        if not os.path.exists(self.path):
+            return # nothing has ever failed
+
+        with self._lock, self.connection as c:
+            c.execute(
+                'DELETE FROM pending WHERE feed = ? AND idx = ?',
+                (feedname, index)
+            )
+
+
+    def due(self, now=None, limit=None):
+        """
+            Returns a list of (feedname, index, attempts) of the entries
+            due to be retried, the ones that have waited longer first.
+        """
+
+        if now is None:
+            now = time.time()
+
+        if not os.path.exists(self.path):
+            return []
+
+        sql = 'SELECT feed, idx, attempts FROM pending ' \
+            'WHERE next_attempt <= ? ORDER BY next_attempt'
+        params = [now]
+
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(limit)
+
+        with self._lock:
+            return self.connection.execute(sql, params).fetchall()
+
+
+    def __len__(self):
+        """ Number of entries in the queue, including given up ones """
+
+        if not os.path.exists(self.path):
+            return 0
+
+        with self._lock:
+            return self.connection.execute(
+                'SELECT COUNT(*) FROM pending'
+            ).fetchone()[0]
@@ -0,0 +1,283 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class FeedRegistry, the process-wide cache
+    of the feeds of a corpus folder.
+
+    Loading the feeds means reading feeds.json and the metadata.json
+    of every feed. The registry does it once and afterwards only re-reads
+    the files whose mtime (or size) changed, so load_feeds and lookups
+    by name don't cost a file read per feed on every call.
+    generation is increased whenever the registry sees a change,
+    so that callers can cache anything derived from the feeds.
+
+    Changes can be batched, writing feeds.json and the metadata
+    of the modified feeds only once, when the batch finishes:
+        feeds = registry(folder)
+
+        with feeds.batch():
+            for name, link in new_feeds:
+                feeds.add(name, link)
+
+            feed = feeds.get('feedname')
+            feed.active = False
+            feeds.save_metadata(feed)
+"""
+
+import os
+import os.path
+import json
+import shutil
+import threading
+
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from .feed import Feed
+
+
+FEEDS_FILE = 'feeds.json'
+METADATA_FILE = 'metadata.json'
+
+_registries = {}
+_registries_lock = threading.Lock()
+
+
+def registry(folder):
+    """ Returns the process-wide FeedRegistry of the corpus in folder """
+
+    key = os.path.abspath(folder)
+
+    with _registries_lock:
+        if key not in _registries:
+            _registries[key] = FeedRegistry(folder)
+
+        return _registries[key]
+
+
+def _stamp(path):
+    """ Returns what identifies a version of the file in path """
+
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+
+    return st.st_mtime_ns, st.st_size
+
+
+class FeedRegistry(object):
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder of the corpus, where feeds.json is
+        """
+
+        self.folder = folder
+        self.path = os.path.join(folder, FEEDS_FILE)
+
+        self.generation = 0
+
+        self._lock = threading.RLock()
+        self._stamp = None # of feeds.json when it was last read
+        self._feeds = OrderedDict() # {name: [link, metadata stamp, Feed]}
+
+        self._batch = 0 # depth of nested batches
+        self._dirty = False # feeds.json must be written
+        self._dirty_feeds = OrderedDict() # {name: Feed} to save metadata
+
+
+    def _metadata_path(self, name):
+        return os.path.join(self.folder, name, METADATA_FILE)
+
+
+    def _refresh(self):
+        """ Re-reads feeds.json if it changed since the last time """
+
+        if self._batch:
+            return # we own the changes until the batch finishes
+
+        stamp = _stamp(self.path)
+        if stamp == self._stamp:
+            return
+
+        try:
+            with open(self.path) as f:
+                j = json.loads(f.read())
+        except:
+            j = []
+
+        feeds = OrderedDict()
+        for x in j:
+            item = self._feeds.get(x['name'], [None, None, None])
+            item[0] = x.get('link')
+            feeds[x['name']] = item
+
+        self._feeds = feeds
+        self._stamp = stamp
+        self.generation += 1
+
+
+    def _feed(self, name, item):
+        """ Returns the Feed of item, reloading it if its metadata changed """
+
+        if name in self._dirty_feeds:
+            return item[2] # modified in this batch; not saved yet
+
+        stamp = _stamp(self._metadata_path(name))
+
+        if item[2] is None or item[1] != stamp:
+            item[2] = Feed(self.folder, name)
+            item[1] = stamp
+
+            self.generation += 1
+
+        return item[2]
+
+
+    def feeds(self):
+        """ Returns a list with all the feeds, in the order of feeds.json """
+
+        with self._lock:
+            self._refresh()
+
+            return [
+                self._feed(name, item)
+                for name, item in self._feeds.items()
+            ]
+
+
+    def names(self):
+        """ Returns a list with the names of all the feeds """
+
+        with self._lock:
+            self._refresh()
+
+            return list(self._feeds)
+
+
+    def get(self, name):
+        """ Returns the feed with that name, or None if there isn't any """
+
+        with self._lock:
+            self._refresh()
+
+            item = self._feeds.get(name)
+            if item is None:
+                return None
+
+            return self._feed(name, item)
+
+
+    def __contains__(self, name):
+        with self._lock:
+            self._refresh()
+
+            return name in self._feeds
+
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+
+            return len(self._feeds)
+
+
+    def add(self, name, link):
+        """ Adds a feed to the corpus and returns it """
+
+        with self.batch():
+            feed = Feed(self.folder, name, link=link)
+
+            self._feeds[name] = [link, None, feed]
+            self._dirty_feeds[name] = feed
+            self._dirty = True
+            self.generation += 1
+
+            return feed
+
+
+    def remove(self, name):
+        """ Removes a feed from the corpus, deleting all its data """
+
+        with self.batch():
+            self._feeds.pop(name, None)
+            self._dirty_feeds.pop(name, None)
+            self._dirty = True
+            self.generation += 1
+
+            try:
+                shutil.rmtree(os.path.join(self.folder, name))
+            except:
+                # Doesn't exist? Doens't matter; we were deleting it anyway
+                pass
+
+
+    def save_metadata(self, feed):
+        """
+            Saves the metadata of feed, or when the current batch finishes.
+            Use it instead of feed.save_metadata() so that the registry
+            doesn't need to reload the feed afterwards.
+        """
+
+        with self.batch():
+            self._dirty_feeds[feed.name] = feed
+
+
+    def save(self):
+        """ Writes feeds.json and the metadata of the modified feeds """
+
+        with self._lock:
+            for name, feed in self._dirty_feeds.items():
+                feed.save_metadata()
+
+                item = self._feeds.get(name)
+                if item is not None:
+                    item[1] = _stamp(self._metadata_path(name))
+                    item[2] = feed
+
+            self._dirty_feeds.clear()
+
+            if self._dirty:
+                if not os.path.exists(self.folder):
+                    os.makedirs(self.folder)
+
+                tmp = self.path + '.tmp'
+                with open(tmp, 'w') as f:
+                    f.write(json.dumps([
+                        {
+                            'name': name,
+                            'link': item[2].link if item[2] is not None \
+                                else item[0]
+                        }
+
+                        for name, item in self._feeds.items()
+                    ], indent=2))
+
+                os.replace(tmp, self.path)
+
+                self._stamp = _stamp(self.path)
+                self._dirty = False
+
+
+    @contextmanager
+    def batch(self):
+        """
+            Context manager that delays all writes (feeds.json and metadata)
+            until the outermost batch finishes. Holds the registry lock,
+            so other threads wait for the batch to finish.
+        """
+
+        with self._lock:
+            self._refresh() # start from the latest version on disk
+            self._batch += 1
+
+            try:
+                yield self
+            finally:
+                self._batch -= 1
+
+                if not self._batch:
+                    self.save()
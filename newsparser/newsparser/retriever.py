@@ -15,14 +15,19 @@
 
         * Whenever you want to update the feeds (1 hour intervals recommended),
           call update_feeds.
+          Alternatively, run scheduler.Scheduler().run(), which polls
+          each feed at its own pace.
 """
 
 import json
 import os
-import shutil
+
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlparse
 
 import newsparser
-from . import Feed
+from .registry import registry
 from .exceptions import NewsparserException
 
 import logging
@@ -47,82 +52,115 @@ def save_feeds(feeds):
 
 def load_feeds():
     """
-        Returns a list with all the feeds added to the system
+        Returns a list with all the feeds added to the system.
+        Feeds are cached by the registry of folder (see registry module),
+        so only the files changed since the last call are read again.
     """
 
-    try:
-        with open(os.path.join(folder, 'feeds.json'), 'r') as f:
-            j = json.loads(f.read())
-    except:
-        j = []
+    return registry(folder).feeds()
+
 
-    return [ Feed(folder, x['name']) for x in j ]
+def update_feeds(max_workers=16, max_per_host=2, timeout=30, feeds=None):
+    """ 
+        Retrieves RSS feed in search for new entries.
 
+        Feeds are polled concurrently, with up to max_workers requests
+        at the same time and no more than max_per_host to the same host,
+        so that a slow server only delays its own feeds.
+        Requests taking more than timeout seconds are aborted
+        (and retried in the next update).
 
-def update_feeds():
-    """ Retrieves RSS feed in search for new entries """
+        If feeds, a list of Feed, is given, only those are polled.
+        Returns a dict {feed name: result of feed.update()},
+        with None for feeds whose update failed.
+    """
 
     logging.info("Updating feeds")
     print("Updating feeds")
-    feeds = load_feeds()
+    if feeds is None:
+        feeds = load_feeds()
 
+    # Feeds waiting to be polled, by host
+    queues = OrderedDict()
     for feed in feeds:
+        host = urlparse(feed.link or '').netloc
+        queues.setdefault(host, deque()).append(feed)
+
+    def update(feed):
         try:
-            feed.update()
+            return feed.update(timeout=timeout)
         except NewsparserException as e:
-            # Feed is deactivated in these cases.
+            # Feed is deactivated in these cases.
             logging.warning('Feed "{name}" has been deactivated '
                 'because of Exception {e}'.format(name=feed.name, e=e))
+        except Exception:
+            # Don't let a feed stop the update of the rest
+            logging.exception(
+                'Feed "{name}" couldn\'t be updated'.format(name=feed.name)
+            )
 
+    results = {}
+    running = {} # {future: (host, feed)}
+    per_host = dict.fromkeys(queues, 0) # running polls by host
 
-def add_feed(name, link):
-    """ Adds a feed to the system """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while True:
+            # Only submit feeds whose host has a free slot,
+            # so that feeds waiting for a slow host don't take workers;
+            # hosts take turns, one feed each
+            submitted = True
+            while submitted and len(running) < max_workers:
+                submitted = False
+
+                for host, queue in queues.items():
+                    if len(running) >= max_workers:
+                        break
+
+                    if queue and per_host[host] < max_per_host:
+                        feed = queue.popleft()
+
+                        running[executor.submit(update, feed)] = (host, feed)
+                        per_host[host] += 1
+                        submitted = True
+
+            if not running:
+                break
 
-    feeds = load_feeds()
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
 
-    feed = Feed(folder, name, link=link)
-    feeds.append(feed)
+            for future in done:
+                host, feed = running.pop(future)
+                per_host[host] -= 1
 
-    feed.save_metadata()
-    save_feeds(feeds)
+                results[feed.name] = future.result()
+
+    return { feed.name: results.get(feed.name) for feed in feeds }
+
+
+def add_feed(name, link):
+    """ Adds a feed to the system """
+
+    registry(folder).add(name, link)
 
 
 def delete_feed(name):
     """ Deletes a feed from the system """
-    
-    feeds = load_feeds()
-    feeds = [ x for x in feeds if x.name != name ]
-
-    try:
-        shutil.rmtree(os.path.join(folder, name))
-    except:
-        # Doesn't exist? Doens't matter; we were deleting it anyway
-        pass
 
-    save_feeds(feeds)
+    registry(folder).remove(name)
 
 
 def load_feed(name):
     """ Returns the feed whose name is that in the parameter """
-    feeds = load_feeds()
-
-    for feed in feeds:
-        if feed.name == name:
-            return feed
+    return registry(folder).get(name)
 
 
 def change_active(name, active):
     """ Change active status for the given feed """
-    feeds = load_feeds()
-
-    feed = None
-    for x in feeds:
-        if x.name == name:
-            feed = x
-            break
+    feeds = registry(folder)
 
+    feed = feeds.get(name)
     if feed is None:
         raise KeyError(name)
 
     feed.active = active
-    save_feeds(feeds)
\ No newline at end of file
+    feeds.save_metadata(feed)
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class Scheduler, a long-running replacement
+    for calling retriever.update_feeds on a fixed cron interval.
+
+    Each feed gets its own poll interval, adapted from its history:
+    feeds that keep returning nothing new are polled less and less often,
+    while feeds that publish a lot are polled more often,
+    always within [min_interval, max_interval].
+
+    The history is kept in feed.polling, stored in the feed metadata:
+        interval - current poll interval, in seconds
+        last_poll - timestamp of the last poll
+        next_poll - timestamp when the feed is due again
+        rate - exponential moving average of new entries per second
+        polls, new_entries - total number of polls and of new entries
+        quiet - consecutive polls without new entries
+        errors - consecutive polls that failed
+
+    Usage example:
+        from newsparser import retriever
+        from newsparser.scheduler import Scheduler
+
+        retriever.folder = 'feeds'
+        Scheduler().run()
+"""
+
+import time
+
+from . import retriever
+from .registry import registry
+
+import logging
+
+
+class Scheduler(object):
+
+    MIN_INTERVAL = 5 * 60
+    MAX_INTERVAL = 24 * 60 * 60
+    DEFAULT_INTERVAL = 60 * 60 # the old cron interval
+
+    TARGET_ENTRIES = 5 # new entries we'd like to find in each poll
+    BACKOFF = 1.5 # interval multiplier after a poll without news
+    ERROR_BACKOFF = 2 # interval multiplier after a failed poll
+    RATE_WEIGHT = 0.3 # weight of the last poll in the rate average
+
+
+    def __init__(
+        self, min_interval=MIN_INTERVAL, max_interval=MAX_INTERVAL,
+        target_entries=TARGET_ENTRIES, **update_kwargs
+    ):
+        """
+            Parameters:
+                min_interval, max_interval - bounds of the poll interval
+                    of every feed, in seconds
+                target_entries - the interval of a feed is set so that
+                    each poll finds about this number of new entries
+                update_kwargs - passed to retriever.update_feeds
+                    (max_workers, max_per_host, timeout)
+        """
+
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_entries = target_entries
+        self.update_kwargs = update_kwargs
+
+
+    def _clip(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+
+    def due(self, feeds, now=None):
+        """ Returns the active feeds in feeds that need to be polled now """
+
+        if now is None:
+            now = time.time()
+
+        return [
+            feed
+            for feed in feeds
+            if feed.active and feed.polling.get('next_poll', 0) <= now
+        ]
+
+
+    def adapt(self, feed, new_entries, now=None):
+        """
+            Updates the polling history of feed after a poll
+            that found new_entries entries (None if it failed)
+            and sets its next poll accordingly.
+        """
+
+        if now is None:
+            now = time.time()
+
+        polling = feed.polling
+        interval = polling.get('interval', self.DEFAULT_INTERVAL)
+        elapsed = max(now - polling.get('last_poll', now - interval), 1)
+
+        if new_entries is None:
+            polling['errors'] = polling.get('errors', 0) + 1
+            interval *= self.ERROR_BACKOFF
+
+        else:
+            polling['errors'] = 0
+            polling['polls'] = polling.get('polls', 0) + 1
+            polling['new_entries'] = \
+                polling.get('new_entries', 0) + new_entries
+
+            rate = new_entries / elapsed
+            if 'rate' in polling:
+                rate = self.RATE_WEIGHT * rate + \
+                    (1 - self.RATE_WEIGHT) * polling['rate']
+
+            polling['rate'] = rate
+
+            if new_entries:
+                polling['quiet'] = 0
+                interval = self.target_entries / rate
+            else:
+                polling['quiet'] = polling.get('quiet', 0) + 1
+                interval *= self.BACKOFF
+
+        interval = self._clip(interval)
+
+        polling['interval'] = interval
+        polling['last_poll'] = now
+        polling['next_poll'] = now + interval
+
+
+    def run_once(self):
+        """
+            Polls all feeds that are due and updates their history.
+            Returns the timestamp when the next feed will be due,
+            or None if there are no active feeds.
+        """
+
+        registered = registry(retriever.folder)
+        due = self.due(registered.feeds())
+
+        if due:
+            results = retriever.update_feeds(feeds=due, **self.update_kwargs)
+            now = time.time()
+
+            # Write all the metadata once every feed has been adapted
+            with registered.batch():
+                for feed in due:
+                    if not feed.active:
+                        continue # deactivated during the update
+
+                    self.adapt(feed, results.get(feed.name), now)
+                    registered.save_metadata(feed)
+
+        feeds = registered.feeds()
+
+        next_polls = [
+            feed.polling.get('next_poll', 0)
+            for feed in feeds
+            if feed.active
+        ]
+
+        return min(next_polls) if next_polls else None
+
+
+    def run(self):
+        """ Polls feeds as they are due, until interrupted """
+
+        while True:
+            next_poll = self.run_once()
+
+            if next_poll is None:
+                # No active feeds; check again later in case they're added
+                next_poll = time.time() + self.min_interval
+
+            wait = next_poll - time.time()
+            if wait > 0:
+                logging.info('Next poll in %d seconds' % wait)
+                time.sleep(wait)
@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with class FeedStats, aggregate counters of the entries
+    of a feed, kept up to date by Feed.save_entries
+    so that reports don't need to read the entries at all.
+
+    Besides the counters, a signature file keeps what each entry
+    contributed to them (its flags and date) as an int64 per index,
+    so that updating an entry subtracts its previous contribution
+    without reading its previous record.
+"""
+
+import os
+import os.path
+import json
+
+from array import array
+from datetime import datetime
+
+from .columns import FeedColumns
+
+
+class FeedStats(object):
+    """
+        Stats of a feed, as returned by get():
+            entries - number of entries
+            flags - {flag: number of entries with that flag}
+            dates - {date: number of entries with that data['date']}
+    """
+
+    STATS_FILE = 'stats.json'
+    SIGNATURES_FILE = 'signatures.bin'
+
+    # Each flag is a function (entry) -> bool.
+    # Besides the ones of FeedColumns (passing each filter),
+    # count the entries that each filter discarded.
+    # Signatures keep them by position, so only append new ones
+    FLAGS = FeedColumns.FLAGS + [
+        ('discarded',
+            lambda e: e.data.get('filter', {}).get('discarded') is True),
+        ('duplicate',
+            lambda e: e.data.get('filter', {}).get('duplicate') is True),
+        ('news_agency_discarded',
+            lambda e: e.data.get('filter', {}).get(
+                'news_agency_discarded'
+            ) is True),
+    ]
+
+    FLAG_BITS = { name: 1 << n for n, (name, _) in enumerate(FLAGS) }
+
+    # Signature: bit 0 if there's an entry, flags in the following bits
+    # and date ordinal (0 if None) from DATE_SHIFT on
+    FLAGS_SHIFT = 1
+    DATE_SHIFT = 32
+
+    SIGNATURE_SIZE = array('q').itemsize
+
+
+    def __init__(self, folder):
+        """
+            Parameters:
+                folder - folder where to store the stats,
+                    usually the feed folder.
+        """
+
+        self.folder = folder
+
+
+    def exists(self):
+        return os.path.exists(os.path.join(self.folder, self.STATS_FILE))
+
+
+    def get(self):
+        """ Returns the dict with the stats (see the class docstring) """
+
+        try:
+            with open(os.path.join(self.folder, self.STATS_FILE)) as f:
+                return json.loads(f.read())
+        except (OSError, ValueError):
+            return self._empty()
+
+
+    def _empty(self):
+        return {
+            'entries': 0,
+            'flags': { name: 0 for name, _ in self.FLAGS },
+            'dates': {}
+        }
+
+
+    def _save(self, stats):
+        tmp = os.path.join(self.folder, self.STATS_FILE + '.tmp')
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(stats, indent=2, sort_keys=True))
+
+        os.replace(tmp, os.path.join(self.folder, self.STATS_FILE))
+
+
+    def signature(self, entry):
+        """ Returns the int64 signature of entry """
+
+        sig = 1
+
+        for name, f in self.FLAGS:
+            if f(entry):
+                sig |= self.FLAG_BITS[name] << self.FLAGS_SHIFT
+
+        try:
+            date = datetime.strptime(entry.data.get('date'), '%Y-%m-%d')
+            sig |= date.toordinal() << self.DATE_SHIFT
+        except (TypeError, ValueError):
+            pass # no date
+
+        return sig
+
+
+    def _apply(self, stats, sig, n):
+        """ Adds n times signature sig to stats """
+
+        if not sig & 1:
+            return # no entry
+
+        stats['entries'] += n
+
+        flags = sig >> self.FLAGS_SHIFT
+        for name, bit in self.FLAG_BITS.items():
+            if flags & bit:
+                stats['flags'][name] = stats['flags'].get(name, 0) + n
+
+        ordinal = sig >> self.DATE_SHIFT
+        if ordinal:
+            date = datetime.fromordinal(ordinal).strftime('%Y-%m-%d')
+
+            count = stats['dates'].get(date, 0) + n
+            if count:
+                stats['dates'][date] = count
+            else:
+                del stats['dates'][date]
+
+
+    def update(self, entries):
+        """
+            Updates the stats with the current state of entries,
+            a list sorted by index. Callers must make sure
+            that no one else updates the same stats at the same time.
+        """
+
+        if not entries:
+            return
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        low = entries[0].index
+        high = entries[-1].index + 1
+
+        path = os.path.join(self.folder, self.SIGNATURES_FILE)
+        sigs = array('q')
+
+        # Read the signatures of the span of the entries
+        mode = 'r+b' if os.path.exists(path) else 'w+b'
+        with open(path, mode) as f:
+            f.seek(low * self.SIGNATURE_SIZE)
+            data = f.read((high - low) * self.SIGNATURE_SIZE)
+            data = data[:len(data) - len(data) % self.SIGNATURE_SIZE]
+
+            sigs.frombytes(data)
+            sigs.extend([0] * (high - low - len(sigs)))
+
+            stats = self.get()
+
+            for entry in entries:
+                old = sigs[entry.index - low]
+                new = self.signature(entry)
+
+                if old != new:
+                    self._apply(stats, old, -1)
+                    self._apply(stats, new, 1)
+                    sigs[entry.index - low] = new
+
+            # Writing beyond the end of the file fills the gap with zeros,
+            # which are missing entries
+            f.seek(low * self.SIGNATURE_SIZE)
+            f.write(sigs.tobytes())
+
+        self._save(stats)
+
+
+    def rebuild(self, entries):
+        """
+            Computes the stats from scratch from the iterable entries,
+            all the entries of the feed, writing them only when finished.
+        """
+
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+
+        stats = self._empty()
+        sigs = array('q')
+
+        for entry in entries:
+            if entry.index >= len(sigs):
+                sigs.extend([0] * (entry.index + 1 - len(sigs)))
+
+            self._apply(stats, sigs[entry.index], -1)
+            sigs[entry.index] = self.signature(entry)
+            self._apply(stats, sigs[entry.index], 1)
+
+        path = os.path.join(self.folder, self.SIGNATURES_FILE)
+        with open(path, 'wb') as f:
+            f.write(sigs.tobytes())
+
+        self._save(stats)
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Module with the storage backends for article contents
+    and the rest of documents of the project (Wikipedia data, tags...).
+
+    All modules get their databases from database(name),
+    so that the backend can be chosen in a single place:
+        * MongoStorage - a MongoDB server (the default)
+        * SQLiteStorage - a single SQLite file, with no server at all,
+            for single-node batch jobs
+
+    Both offer the subset of the pymongo API used in the project:
+        db = database('entries')
+        collection = db['feedname'] # or db.feedname
+
+        collection.find_one(query, projection)
+        collection.find(query, projection) # with .count()
+        collection.update_one(query, {'$set': {...}}, upsert=True)
+        collection.insert_one(document)
+        collection.insert_many(documents)
+        collection.create_index(field)
+
+    where queries are {field: value}, {field: {'$in': [values]}}
+    or {field: {'$exists': bool}}.
+
+    The backend is configured with a URI, either with configure(uri)
+    or with the environment variable NEWSPARSER_STORAGE:
+        mongodb://host:port/ - MongoDB (default: local server)
+        sqlite:///path/to/file.db - SQLite file
+"""
+
+import os
+import re
+import json
+import base64
+import sqlite3
+import threading
+
+
+ENV_VARIABLE = 'NEWSPARSER_STORAGE'
+
+_uri = None
+_storages = {} # {uri: storage}
+_storages_lock = threading.Lock()
+
+
+def configure(uri):
+    """ Sets the URI of the backend used by all databases from now on """
+    global _uri
+    _uri = uri
+
+
+def get_storage(uri=None):
+    """ Returns the storage for uri (by default, the configured one) """
+
+    if uri is None:
+        uri = _uri or os.environ.get(ENV_VARIABLE) or 'mongodb://'
+
+    with _storages_lock:
+        if uri not in _storages:
+            if uri.startswith('sqlite://'):
+                _storages[uri] = SQLiteStorage(uri[len('sqlite://'):])
+            elif uri.startswith('mongodb://'):
+                _storages[uri] = MongoStorage(uri)
+            else:
+                raise ValueError('Unknown storage URI "%s"' % uri)
+
+        return _storages[uri]
+
+
+def database(name):
+    """
+        Returns database name of the configured storage.
+        The backend is only resolved when the database is first used,
+        so configure can be called after importing the modules that use it.
+    """
+
+    return Database(name)
+
+
+class Database(object):
+    """ Database of the configured storage, resolved on every access """
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def __getitem__(self, collection):
+        return get_storage().database(self.name)[collection]
+
+
+    def __getattr__(self, collection):
+        if collection.startswith('_'):
+            raise AttributeError(collection)
+
+        return self[collection]
+
+
+class MongoStorage(object):
+
+    def __init__(self, uri):
+        from pymongo import MongoClient
+
+        self.client = MongoClient(uri if uri != 'mongodb://' else None)
+
+
+    def database(self, name):
+        return self.client[name]
+
+
+class SQLiteStorage(object):
+    """
+        Stores every collection in a table of the same SQLite file,
+        with a row per document, encoded in JSON.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+        # Connections are shared by threads, so access them with the lock
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+
+        with self.lock:
+            self.connection.execute('PRAGMA journal_mode=WAL')
+
+        # Tables are created once, when their collection is first requested
+        self._collections = {} # {table: SQLiteCollection}
+
+
+    def database(self, name):
+        return SQLiteDatabase(self, name)
+
+
+    def collection(self, table):
+        """ Returns the collection stored in table, creating it if needed """
+
+        with self.lock:
+            if table not in self._collections:
+                self._collections[table] = SQLiteCollection(self, table)
+
+            return self._collections[table]
+
+
+class SQLiteDatabase(object):
+
+    def __init__(self, storage, name):
+        self.storage = storage
+        self.name = name
+
+
+    def __getitem__(self, collection):
+        return self.storage.collection(self.name + '.' + collection)
+
+
+    def __getattr__(self, collection):
+        if collection.startswith('_'):
+            raise AttributeError(collection)
+
+        return self[collection]
+
+
+def _default(obj):
+    # Binary values (like compressed contents) are encoded as in MongoDB
+    if isinstance(obj, (bytes, bytearray)):
+        return { '$binary': base64.b64encode(obj).decode('ascii') }
+
+    raise TypeError('%r is not JSON serializable' % obj)
+
+
+def _object_hook(d):
+    if len(d) == 1 and '$binary' in d:
+        return base64.b64decode(d['$binary'])
+
+    return d
+
+
+def _quote(name):
+    """ Returns name quoted as an SQL identifier """
+    return '"%s"' % name.replace('"', '""')
+
+
+def _dumps(document):
+    return json.dumps(document, default=_default)
+
+
+def _loads(s):
+    return json.loads(s, object_hook=_object_hook)
+
+
+class Cursor(list):
+    """ List of documents that also answers pymongo's cursor.count() """
+
+    def count(self):
+        return len(self)
+
+
+class SQLiteCollection(object):
+
+    FIELD_REGEX = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+
+    def __init__(self, storage, table):
+        self.storage = storage
+        self.table = table
+
+        self._name = _quote(table) # table names come from feed names
+        self._indexes = set() # fields already indexed
+
+        with self.storage.lock, self.storage.connection as c:
+            c.execute(
+                'CREATE TABLE IF NOT EXISTS %s '
+                '(id INTEGER PRIMARY KEY, doc TEXT NOT NULL)' % self._name
+            )
+
+
+    def _path(self, field):
+        """ Returns the JSON path of field, as an SQL string """
+
+        if not self.FIELD_REGEX.match(field):
+            raise ValueError('Invalid field name "%s"' % field)
+
+        return "'$.%s'" % field
+
+
+    def _field(self, field):
+        return 'json_extract(doc, %s)' % self._path(field)
+
+
+    def _exists(self, field, exists):
+        # json_type is NULL only for missing fields, not for null values
+        return 'json_type(doc, %s) IS %sNULL' % (
+            self._path(field), 'NOT ' if exists else ''
+        )
+
+
+    def _where(self, query):
+        """ Returns (SQL condition, parameters) for a query dict """
+
+        conditions = ['1']
+        params = []
+
+        for field, value in (query or {}).items():
+            if isinstance(value, dict):
+                if not value or set(value) - {'$in', '$exists'}:
+                    raise ValueError('Unsupported query %s' % value)
+
+                if '$exists' in value:
+                    conditions.append(
+                        self._exists(field, bool(value['$exists']))
+                    )
+
+                if '$in' in value:
+                    values = list(value['$in'])
+                    if not values:
+                        conditions.append('0')
+                        continue
+
+                    conditions.append('%s IN (%s)' % (
+                        self._field(field), ', '.join('?' * len(values))
+                    ))
+                    params.extend(values)
+            else:
+                conditions.append('%s = ?' % self._field(field))
+                params.append(value)
+
+        return ' AND '.join(conditions), params
+
+
+    @staticmethod
+    def _project(doc, projection):
+        if not projection:
+            return doc
+
+        keys = { k for k, v in projection.items() if v }
+        if projection.get('_id', True):
+            keys.add('_id')
+
+        return { k: v for k, v in doc.items() if k in keys }
+
+
+    def _select(self, query, limit=None):
+        where, params = self._where(query)
+        sql = 'SELECT id, doc FROM %s WHERE %s' % (self._name, where)
+
+        if limit is not None:
+            sql += ' LIMIT %d' % limit
+
+        with self.storage.lock:
+            return [
+                (rowid, _loads(doc))
+                for rowid, doc in self.storage.connection.execute(sql, params)
+            ]
+
+
+    def find(self, query=None, projection=None):
+        return Cursor(
+            self._project(doc, projection)
+            for _, doc in self._select(query)
+        )
+
+
+    def find_one(self, query=None, projection=None):
+        rows = self._select(query, limit=1)
+
+        if rows:
+            return self._project(rows[0][1], projection)
+
+
+    def insert_one(self, document):
+        self.insert_many([document])
+
+
+    def insert_many(self, documents):
+        with self.storage.lock, self.storage.connection as c:
+            c.executemany(
+                'INSERT INTO %s (doc) VALUES (?)' % self._name,
+                ((_dumps(d),) for d in documents)
+            )
+
+
+    def update_one(self, query, update, upsert=False):
+        if set(update) != {'$set'}:
+            raise ValueError('Only $set updates are supported')
+
+        with self.storage.lock, self.storage.connection as c:
+            rows = self._select(query, limit=1)
+
+            if rows:
+                rowid, doc = rows[0]
+                doc.update(update['$set'])
+
+                c.execute(
+                    'UPDATE %s SET doc = ? WHERE id = ?' % self._name,
+                    (_dumps(doc), rowid)
+                )
+
+            elif upsert:
+                doc = {
+                    k: v
+                    for k, v in query.items()
+                    if not isinstance(v, dict)
+                }
+                doc.update(update['$set'])
+
+                c.execute(
+                    'INSERT INTO %s (doc) VALUES (?)' % self._name,
+                    (_dumps(doc),)
+                )
+
+
+    def create_index(self, field):
+        if field in self._indexes:
+            return
+
+        name = _quote('%s.%s' % (self.table, field))
+
+        with self.storage.lock, self.storage.connection as c:
+            c.execute('CREATE INDEX IF NOT EXISTS %s ON %s (%s)' % (
+                name, self._name, self._field(field)
+            ))
+
+        self._indexes.add(field)
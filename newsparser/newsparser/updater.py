@@ -7,114 +7,384 @@
     When a new one is found, it retrieves its contents from its url.
 """
 
-import time
+import os
 import os.path
 import json
 
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import islice
+
 import requests
+import requests.adapters
 
 from . import Feed, Entry
+from .downloader import Downloader, parse_article
+from .archive import html_archive, unpack
+from .pending import pending_queue
 
 url = 'http://newsparser704.pythonanywhere.com/'
 headers = {'Accept': 'application/json'}
+cursor_file = 'sync.json' # page being synced, in each feed folder
+
+
+def _save_in_batches(feed, entries, batch_size):
+    """
+        Saves the entries of the iterable in feed every batch_size entries,
+        so that if the process is interrupted
+        only the entries of the last batch are lost.
+    """
+
+    batch = []
+
+    try:
+        for entry in entries:
+            batch.append(entry)
+
+            if len(batch) >= batch_size:
+                feed.save_entries(batch)
+                feed.save_metadata()
+                batch = []
+
+    finally:
+        # Save what was processed
+        feed.save_entries(batch)
+        # Notice that feed won't be really affected until the following line
+        # since num_entries won't be updated in the storage file
+        # until all metadata is saved. So, interrupting it here isn't a risk
+        feed.save_metadata()
+
+
+def _session(max_workers):
+    """
+        Returns a requests.Session for the server, that keeps up to
+        max_workers connections open and accepts gzip-compressed responses
+    """
+
+    session = requests.Session()
+    session.headers.update(headers)
+    session.headers['Accept-Encoding'] = 'gzip, deflate'
+
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=max_workers, pool_maxsize=max_workers
+    )
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    return session
+
+
+def _cursor_path(folder, name):
+    return os.path.join(folder, name, cursor_file)
+
+
+def _load_cursor(folder, name):
+    """ Returns the page of entries that was being synced, if any """
+
+    try:
+        with open(_cursor_path(folder, name)) as f:
+            return json.loads(f.read())
+    except (OSError, ValueError):
+        return []
+
+
+def _save_cursor(folder, name, page):
+    path = _cursor_path(folder, name)
+
+    with open(path + '.tmp', 'w') as f:
+        f.write(json.dumps(page))
 
+    os.replace(path + '.tmp', path)
 
-def update_local(folder, download_content=True):
-    """ Updates local storage to the server's state """
-    feeds = requests.get(url + 'feeds', headers=headers).json()
+
+def _sync_feed(session, folder, name, downloader, download_content,
+    batch_size, page_size):
+    """ Updates local storage of feed name to the server's state """
+
+    # Try to obtain the last entry_index that's been downloaded
+    try:
+        with open(os.path.join(folder, name, 'metadata.json')) as f:
+            j = json.loads(f.read())
+            low = j.get('num_entries', 0)
+    except FileNotFoundError:
+        low = 0
+
+    d = session.get(url + 'feeds/{}/'.format(name)).json()
+    high = d.get('num_entries', 0)
+
+    if low == high:
+        return # nothing new to download
+
+    print ('Downloading from {}'.format(name))
+
+    feed = Feed(folder, name, metadata=d)
+    # Set low as num_entries so we can execute save_entries
+    # with the new entries correctly. 
+    # This method will update num_entries accordingly when finished.
+    feed.num_entries = low
+
+    # If a previous sync was interrupted, resume its page
+    page = [
+        metadata
+        for metadata in _load_cursor(folder, name)
+        if metadata['index'] >= low
+    ]
+
+    while feed.num_entries < high:
+        if not page:
+            page = session.get(
+                url + 'feeds/{feedname}/entries/'.format(feedname=name),
+                params={
+                    'from': feed.num_entries,
+                    'to': min(feed.num_entries + page_size, high)
+                }
+            ).json()
+
+            if not page:
+                break # the server didn't return what it announced
+
+            _save_cursor(folder, name, page)
+
+        entries = (Entry(folder, feed.name, metadata) for metadata in page)
+
+        if download_content:
+            entries = downloader.download(entries)
+
+        _save_in_batches(feed, entries, batch_size)
+        page = []
+
+    _save_cursor(folder, name, [])
+
+
+def update_local(folder, download_content=True, downloader=None,
+    batch_size=100, page_size=500, max_workers=4, selectors=None):
+    """
+        Updates local storage to the server's state.
+
+        max_workers feeds are synced at the same time,
+        requesting their entries in pages of page_size entries.
+        Each feed keeps the page being synced in its cursor_file,
+        so that an interrupted sync resumes from where it stopped.
+
+        Contents are downloaded with downloader, a downloader.Downloader
+        (a default one if None, with the given selectors of the body
+        of the articles of each feed), and entries are saved every batch_size.
+    """
+
+    session = _session(max_workers)
+    feeds = session.get(url + 'feeds/').json()
 
     with open(os.path.join(folder, 'feeds.json'), 'w') as f:
         f.write(json.dumps(feeds, indent=2))
 
-    for name in map(lambda x: x['name'], feeds):
-        print ('Downloading from {}'.format(name))
-
-        # Try to obtain the last entry_index that's been downloaded
-        try:
-            with open(os.path.join(folder, name, 'metadata.json')) as f:
-                j = json.loads(f.read())
-                low = j.get('num_entries', 0)
-        except FileNotFoundError:
-            low = 0
-
-        d = requests.get(url + 'feeds/{}'.format(name), headers=headers).json()
-
-        if low == d.get('num_entries', 0):
-            continue # nothing new to download
-
-        feed = Feed(folder, name, metadata=d)
-        # Set low as num_entries so we can execute save_entries
-        # with the new entries correctly. 
-        # This method will update num_entries accordingly when finished.
-        feed.num_entries = low 
-
-        j = requests.get(
-            url + 'feeds/{feedname}/entries'.format(feedname=name),
-            params={ 'from': low }
-        ).json()
-
-        # Download entries
-        entries = []
-        try:
-            for metadata in j:
-                entry = Entry(folder, feed.name, metadata)
-            
-                if download_content:
-                    entry.load_content()
-
-                entries.append(entry)
-
-                try:
-                    time.sleep(0.5)
-                except AttributeError:
-                    time.wait(0.5)
-            
-            feed.save_entries(entries)
-            # Notice that feed won't be really affected until the following line
-            # since num_entries won't be updated in the storage file
-            # until all metadata is saved. So, interrupting it here isn't a risk
-            feed.save_metadata() 
-
-        except:
-            # Save what was processed
-            feed.save_entries(entries)
-            feed.save_metadata()
-            raise # exit the loop
-
-
-def retry_download(folder, feedname, low=0):
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = Downloader(selectors=selectors)
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(
+                    _sync_feed, session, folder, name, downloader,
+                    download_content, batch_size, page_size
+                )
+
+                for name in map(lambda x: x['name'], feeds)
+            ]
+
+            for future in futures:
+                future.result() # raise any exception
+
+    finally:
+        if own_downloader:
+            downloader.close()
+
+
+def retry_download(folder, feedname, low=0, downloader=None, batch_size=100):
     """ 
         Retries download on all local entries 
         whose content couldn't be downloaded,
         given the feed name and an optional low index
         that states from which entry we'd like to start
-        (to avoid unnecessary retries)
+        (to avoid unnecessary retries).
+        downloader and batch_size work as in update_local.
+
+        This walks all the entries of the feed from low;
+        retry_pending only retries the ones that are due.
     """
 
     with open(os.path.join(folder, feedname, 'metadata.json')) as f:
         j = json.loads(f.read())
         feed = Feed(folder, j['name'])
 
-    all_entries = feed.get_entries(low)
-    updated = []
+    entries = feed.iter_entries(
+        low, predicate=lambda entry: not entry.downloaded
+    )
+
+    if downloader is None:
+        with Downloader() as downloader:
+            _save_in_batches(feed, downloader.download(entries), batch_size)
+    else:
+        _save_in_batches(feed, downloader.download(entries), batch_size)
+
+
+def refresh_content(folder, feedname, low=0, downloader=None):
+    """
+        Fetches again the content of the downloaded entries of the feed
+        from index low on (e.g. recent articles, that may have been edited).
+        Requests are conditional, so only the pages that changed
+        since they were downloaded are parsed and stored again
+        (see Downloader.download). downloader works as in update_local.
+
+        Entry metadata doesn't change, so the feed isn't saved.
+    """
+
+    feed = Feed(folder, feedname)
+
+    entries = feed.iter_entries(
+        low, predicate=lambda entry: entry.downloaded
+    )
+
+    if downloader is None:
+        with Downloader() as downloader:
+            for _ in downloader.download(entries, refresh=True):
+                pass
+    else:
+        for _ in downloader.download(entries, refresh=True):
+            pass
+
+
+def retry_pending(folder, downloader=None, batch_size=100, limit=None,
+    max_workers=4):
+    """
+        Retries the download of the entries that are due
+        in the pending download queue of folder (see pending.PendingQueue),
+        up to limit entries if given, without scanning the feeds.
+        max_workers feeds are retried at the same time.
+        downloader and batch_size work as in update_local.
+
+        Returns the number of entries retried.
+    """
+
+    queue = pending_queue(folder)
+
+    by_feed = {}
+    for feedname, index, _ in queue.due(limit=limit):
+        by_feed.setdefault(feedname, []).append(index)
+
+    if not by_feed:
+        return 0
+
+    def entries(feed, indexes):
+        for index in sorted(indexes):
+            found = feed.get_entries(index, index + 1)
+
+            if not found or found[0].downloaded:
+                # Deleted or already downloaded by other means
+                queue.succeeded(feed.name, index)
+                continue
+
+            yield found[0]
+
+    def retry(feedname, indexes):
+        feed = Feed(folder, feedname)
+
+        _save_in_batches(
+            feed, downloader.download(entries(feed, indexes)), batch_size
+        )
+
+    own_downloader = downloader is None
+    if own_downloader:
+        downloader = Downloader()
 
     try:
-        for entry in all_entries:
-            if not entry.downloaded:
-                entry.load_content()
-                updated.append(entry)
-
-                try:
-                    time.sleep(0.5)
-                except AttributeError:
-                    time.wait(0.5)
-        
-        feed.save_entries(updated)
-        # Same as above
-        feed.save_metadata()
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = [
+                executor.submit(retry, feedname, indexes)
+                for feedname, indexes in by_feed.items()
+            ]
 
-    except:
-        # Save what was processed
-        feed.save_entries(updated)
-        feed.save_metadata()
-        raise # exit the loop
\ No newline at end of file
+            for future in futures:
+                future.result() # raise any exception
+
+    finally:
+        if own_downloader:
+            downloader.close()
+
+    return sum(len(indexes) for indexes in by_feed.values())
+
+
+def _extract(link, codec, data, selectors):
+    """ Returns the text of an archived page (run in the parsing processes) """
+    return parse_article(link, unpack(codec, data), selectors)
+
+
+def reextract(folder, feednames=None, processes=None, batch_size=1000,
+    selectors=None):
+    """
+        Extracts again the content of all the entries whose page is archived
+        (see archive.HtmlArchive), without downloading anything,
+        and stores it as their content, replacing the previous one.
+        Pages are parsed in processes processes (None for the number of CPUs),
+        batch_size pages at a time.
+
+        selectors works as in Downloader, to extract feeds with them
+        before falling back to newspaper.
+
+        If feednames is given, only the entries of those feeds are extracted.
+        Entries that couldn't be parsed before and can now are marked
+        as downloaded; the ones that still can't keep their current content.
+
+        Returns the number of entries whose content was extracted.
+    """
+
+    archive = html_archive(folder)
+
+    if feednames is None:
+        feednames = archive.feeds()
+
+    if selectors is None:
+        selectors = {}
+
+    count = 0
+
+    with ProcessPoolExecutor(processes) as executor:
+        for feedname in feednames:
+            feed = Feed(folder, feedname)
+            pages = archive.iter_pages(feedname)
+
+            while True:
+                batch = list(islice(pages, batch_size))
+                if not batch:
+                    break
+
+                texts = executor.map(
+                    _extract,
+                    [ link for _, link, _, _ in batch ],
+                    [ codec for _, _, codec, _ in batch ],
+                    [ data for _, _, _, data in batch ],
+                    [ selectors.get(feedname) ] * len(batch),
+                    chunksize=16
+                )
+
+                extracted = {
+                    index: (link, text)
+                    for (index, link, _, _), text in zip(batch, texts)
+                    if text is not None
+                }
+
+                downloaded = []
+                for entry in feed.get_entries(batch[0][0], batch[-1][0] + 1):
+                    if entry.index not in extracted:
+                        continue
+
+                    link, text = extracted[entry.index]
+                    if not entry.downloaded:
+                        downloaded.append(entry)
+
+                    entry.save_content(text, links=[link])
+                    count += 1
+
+                # Only these entries changed their metadata
+                feed.save_entries(downloaded)
+
+    return count
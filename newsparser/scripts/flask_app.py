@@ -4,21 +4,185 @@
 import json
 import os
 import os.path
+import gzip
+import zlib
+import html
+import calendar
+import threading
+
+from collections import OrderedDict
+from itertools import islice
+from datetime import datetime
+from urllib.parse import urlencode
 
 from flask import Flask, Response, request, abort
-from newsparser.data import load_feeds
+from newsparser.registry import registry
+from newsparser.changes import changelog
 
 folder = 'feeds'
-feeds = load_feeds(folder)
 
 app = Flask(__name__)
 
 
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
 def get_feed(feedname):
-    for feed in feeds:
-        if feed.name == feedname:
-            return feed
-    # returns None if it isn't found
+    # Returns None if it isn't found
+    return registry(folder).get(feedname)
+
+
+def get_feeds():
+    return registry(folder).feeds()
+
+
+# Response cache, {key: (etag, body, gzipped body)}
+CACHE_SIZE = 256
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+# Listings are paginated with ?from=<cursor>&limit=<page size>
+PAGE_SIZE = 1000
+MAX_PAGE_SIZE = 10000
+CACHE_MAX_ENTRIES = 1000 # larger listings are streamed instead of cached
+
+
+def _validators(response, etag, mtime):
+    response.set_etag(etag)
+    response.last_modified = datetime.utcfromtimestamp(mtime)
+    response.headers['Vary'] = 'Accept-Encoding'
+
+    return response
+
+
+def _not_modified(etag, mtime):
+    """
+        Returns whether the client already has the version etag,
+        modified at mtime, according to its conditional headers.
+        If-Modified-Since is only used without If-None-Match,
+        which is more precise.
+    """
+
+    if request.if_none_match:
+        return etag in request.if_none_match
+
+    since = request.if_modified_since
+    if since is None or not mtime:
+        return False
+
+    # HTTP dates have a precision of seconds; naive ones are UTC
+    return int(mtime) <= calendar.timegm(since.utctimetuple())
+
+
+def cached_response(key, etag, mtime, build, mimetype='application/json'):
+    """
+        Returns the response with body build() (bytes) and the given ETag,
+        answering 304 if the client already has it
+        (by its ETag or its modification time)
+        and reusing the body from the cache if it is still valid.
+        Bodies are gzipped if the client accepts it.
+    """
+
+    if _not_modified(etag, mtime):
+        return _validators(Response(status=304), etag, mtime)
+
+    with _cache_lock:
+        cached = _cache.get(key)
+
+        if cached is not None and cached[0] == etag:
+            _cache.move_to_end(key)
+
+    if cached is None or cached[0] != etag:
+        body = build()
+        cached = (etag, body, gzip.compress(body))
+
+        with _cache_lock:
+            _cache[key] = cached
+
+            while len(_cache) > CACHE_SIZE:
+                _cache.popitem(last=False)
+
+    if 'gzip' in request.accept_encodings:
+        response = Response(cached[2], mimetype=mimetype)
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = Response(cached[1], mimetype=mimetype)
+
+    return _validators(response, etag, mtime)
+
+
+def streamed_response(etag, mtime, chunks, mimetype='application/json'):
+    """
+        Returns a chunked response with the bytes in the iterable chunks,
+        so that the body is never fully in memory.
+        Like cached_response, it answers 304 and gzips if possible.
+    """
+
+    if _not_modified(etag, mtime):
+        return _validators(Response(status=304), etag, mtime)
+
+    gzipped = 'gzip' in request.accept_encodings
+
+    def generate():
+        if not gzipped:
+            yield from chunks
+            return
+
+        compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS) # gzip format
+        for chunk in chunks:
+            data = compressor.compress(chunk)
+            if data:
+                yield data
+
+        yield compressor.flush()
+
+    response = Response(generate(), mimetype=mimetype)
+    if gzipped:
+        response.headers['Content-Encoding'] = 'gzip'
+
+    return _validators(response, etag, mtime)
+
+
+def page_args(feed):
+    """
+        Returns (low, high, next) for the page requested
+        with ?from=<cursor>&to=<high>&limit=<page size>.
+        If to isn't given, the page has limit entries (PAGE_SIZE by default)
+        and next is the URL of the following page, if any.
+    """
+
+    try:
+        low = int(request.args.get('from') or 0)
+        high = request.args.get('to')
+        high = None if high is None else int(high)
+        limit = min(int(request.args.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        abort(400)
+
+    if limit <= 0:
+        abort(400)
+
+    # Negative bounds count from the end, as in feed.get_entries,
+    # and both are kept within the feed before sizing the page
+    paged = high is None
+    low, high = feed._bounds(low, high)
+    low = min(low, feed.num_entries)
+    high = max(low, min(high, feed.num_entries))
+
+    next_url = None
+    if paged:
+        high = min(low + limit, high)
+
+        if high < feed.num_entries:
+            args = request.args.to_dict()
+            args.update({ 'from': high, 'limit': limit })
+            next_url = request.base_url + '?' + urlencode(args)
+
+    return low, high, next_url
 
 
 @app.route('/')
@@ -30,15 +194,24 @@ def hello_world():
     </ul>""".format(
         '\n'.join([
             '<li><a href="/feeds/{name}">{name}</a></li>'.format(name=feed.name)
-            for feed in feeds
+            for feed in get_feeds()
         ])
     )
 
 
 @app.route('/feeds/', methods=['GET'])
 def feed_list():
-    with open(os.path.join(folder, 'feeds.json')) as f:
-        return Response(f.read(), mimetype='application/json')
+    path = os.path.join(folder, 'feeds.json')
+    mtime = _mtime(path)
+
+    if mtime is None:
+        abort(404)
+
+    def build():
+        with open(path, 'rb') as f:
+            return f.read()
+
+    return cached_response('feeds', str(mtime), mtime / 1e9, build)
 
 
 @app.route('/feeds/<feedname>/', methods=['GET'])
@@ -53,64 +226,182 @@ def feed_metadata(feedname):
         )
 
         if best_match == 'application/json':
-            return Response(
-                json.dumps(feed.get_metadata()), 
-                mimetype='application/json'
+            mtime = _mtime(os.path.join(folder, feedname, 'metadata.json'))
+
+            return cached_response(
+                ('metadata', feedname), '%s-%s' % (feedname, mtime),
+                (mtime or 0) / 1e9,
+                lambda: json.dumps(feed.get_metadata()).encode('utf-8')
             )
         else:
-            return """
-                <h1> {feedname} </h1>
-                <ul>
-                    {entries}
-                </ul>
-            """.format(
-                feedname=feed.name,
-                entries='\n'.join([
-                    '<li><a href="entries?id={index}">'
-                    '{index} | {title}</a></li>'.format(
-                        index=entry.index,
-                        title=entry.title
-                    )
-                    for entry in feed.get_entries()
-                ])
-            )
+            return feed_html(feed)
+
+
+def feed_html(feed):
+    """ Streams a page of the entries of feed in HTML """
+
+    low, high, next_url = page_args(feed)
+    version, mtime = feed.version(low, high)
+
+    def titles():
+        # Read them from the title columns, without decoding any entry
+        columns = feed.columns
+
+        if columns is None:
+            for entry in feed.iter_entries(low, high):
+                yield entry.index, entry.title
+        else:
+            present = columns.present()[low:high]
+            positions = [ low + int(i) for i in present.nonzero()[0] ]
+
+            for i in range(0, len(positions), PAGE_SIZE):
+                batch = positions[i:i + PAGE_SIZE]
+                yield from zip(batch, columns.titles(batch))
+
+    def chunks():
+        yield '<h1> {feedname} </h1>\n<ul>\n'.format(
+            feedname=html.escape(feed.name)
+        ).encode('utf-8')
+
+        for index, title in titles():
+            yield (
+                '<li><a href="entries?id={index}">'
+                '{index} | {title}</a></li>\n'.format(
+                    index=index,
+                    title=html.escape(title or '')
+                )
+            ).encode('utf-8')
+
+        yield b'</ul>\n'
+
+        if next_url is not None:
+            yield '<a href="{url}">Next</a>\n'.format(
+                url=html.escape(next_url)
+            ).encode('utf-8')
+
+    return streamed_response(
+        'html-' + version, mtime, chunks(), mimetype='text/html'
+    )
 
 
 @app.route('/feeds/<feedname>/entries/', methods=['GET'])
 def feed_entries(feedname):
+    """
+        Returns the entries of the feed in the page given by
+        ?from=<cursor>&to=<high>&limit=<page size> (see page_args)
+        or the entry ?id=<index>, as a JSON list
+        or, with ?format=ndjson, as one JSON entry per line.
+        The URL of the next page, if any, is in the Link header.
+    """
+
     feed = get_feed(feedname)
 
     if feed is None:
         abort(404)
+
+    ids = request.args.get('id')
+
+    if not (ids is None):
+        try:
+            ids = int(ids)
+        except:
+            abort(400)
+
+        if ids < 0:
+            ids, _ = feed._bounds(ids, None)
+
+        low, high, next_url = ids, ids + 1, None
     else:
-        low = request.args.get('from')
-        high = request.args.get('to')
-        ids = request.args.get('id')
+        low, high, next_url = page_args(feed)
 
-        if not (ids is None):
-            try:
-                ids = int(ids)
-            except:
-                abort(400)
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
 
-            if ids < 0:
-                ids = ids % feed.num_entries
+    # Serve records as they are stored, without decoding them
+    def chunks():
+        records = feed.iter_records(low, high)
 
-            low = ids
-            high = ids + 1
+        if ndjson:
+            for _, record in records:
+                # JSON strings can't contain raw newlines, so this is safe
+                yield record.replace(b'\n', b'') + b'\n'
+        else:
+            yield b'['
+            for i, (_, record) in enumerate(records):
+                yield (b',' if i else b'') + record
+            yield b']'
 
-        if low is None:
-            low = 0
-        if high is None:
-            high = feed.num_entries
+    version, mtime = feed.version(low, high)
+    if ndjson:
+        version = 'ndjson-' + version
 
-        try:
-            low = int(low)
-            high = int(high)
-        except:
-            abort(400)
+    mimetype = 'application/x-ndjson' if ndjson else 'application/json'
+
+    if high - low <= CACHE_MAX_ENTRIES:
+        response = cached_response(
+            ('entries', feedname, low, high, ndjson), version, mtime,
+            lambda: b''.join(chunks()), mimetype=mimetype
+        )
+    else:
+        response = streamed_response(version, mtime, chunks(), mimetype)
+
+    if next_url is not None:
+        response.headers['Link'] = '<%s>; rel="next"' % next_url
+
+    return response
+
+
+@app.route('/changes', methods=['GET'])
+def changes():
+    """
+        Returns the changes to entries of all feeds with seq > ?since=<seq>,
+        at most ?limit=<n> (PAGE_SIZE by default), as a JSON list
+        or, with ?format=ndjson, as one JSON change per line.
+        The URL of the next page, if any, is in the Link header.
+    """
+
+    try:
+        since = int(request.args.get('since') or 0)
+        limit = min(int(request.args.get('limit', PAGE_SIZE)), MAX_PAGE_SIZE)
+    except ValueError:
+        abort(400)
+
+    if limit <= 0:
+        abort(400)
+
+    log = changelog(folder)
+    last_seq = log.last_seq()
+
+    ndjson = request.args.get('format') == 'ndjson' or \
+        request.accept_mimetypes.best == 'application/x-ndjson'
+
+    def build():
+        page = list(islice(log.changes(since), limit))
+
+        if ndjson:
+            return ''.join(
+                json.dumps(change) + '\n' for change in page
+            ).encode('utf-8')
+        else:
+            return json.dumps(page).encode('utf-8')
+
+    # Changes are never modified, so the page only depends on the last seq
+    etag = 'changes-%s%d-%d-%d' % ('ndjson-' if ndjson else '', since, limit,
+        last_seq)
+
+    response = cached_response(
+        ('changes', since, limit, ndjson), etag,
+        (_mtime(log.path) or 0) / 1e9, build,
+        mimetype='application/x-ndjson' if ndjson else 'application/json'
+    )
+
+    # Seqs are consecutive, so the page ends at seq since + limit
+    if since + limit < last_seq:
+        args = request.args.to_dict()
+        args.update({ 'since': since + limit, 'limit': limit })
+
+        response.headers['Link'] = '<%s>; rel="next"' % (
+            request.base_url + '?' + urlencode(args)
+        )
 
-        return Response(json.dumps([
-            x.get_metadata()
-            for x in feed.get_entries(low, high)
-        ]), mimetype='application/json')
\ No newline at end of file
+    return response
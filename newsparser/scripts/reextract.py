@@ -0,0 +1,28 @@
+# -*- coding: utf-8-*-
+# Author: Álvaro Parafita (parafita.alvaro@gmail.com)
+
+"""
+    Extracts again the content of all the entries with an archived page
+    (downloaded with Downloader(archive=True)), without network access.
+    Optionally, pass the names of the feeds to extract as arguments.
+"""
+
+import sys
+import time
+
+from newsparser.updater import reextract
+
+try:
+    from newsfilter.ffs import content_selectors
+except ImportError:
+    # Without newsfilter, articles are extracted by newspaper alone
+    content_selectors = dict
+
+folder = '/Users/alvaro_parafita/Desktop/TFG/data'
+
+feednames = sys.argv[1:] or None
+
+start = time.time()
+count = reextract(folder, feednames, selectors=content_selectors())
+
+print('Extracted %d entries in %.1f seconds' % (count, time.time() - start))
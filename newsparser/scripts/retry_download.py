@@ -3,18 +3,26 @@
 
 import pandas as pd
 
-from newsparser.updater import retry_download
+from newsparser.updater import retry_pending
+from newsparser.downloader import Downloader
 from newsparser.data import load_feeds
 
+try:
+    from newsfilter.ffs import content_selectors
+except ImportError:
+    # Without newsfilter, articles are extracted by newspaper alone
+    content_selectors = dict
+
 folder = '/Users/alvaro_parafita/Desktop/TFG/data'
 
 feeds = load_feeds(folder)
 
-# Update local files
+# Retry only the failed downloads that are due (see newsparser.pending),
+# instead of walking every entry of every feed
 try:
-    for feed in feeds:
-        print(feed.name)
-        retry_download(folder, feed.name, low=0)
+    with Downloader(selectors=content_selectors()) as downloader:
+        retried = retry_pending(folder, downloader=downloader)
+        print('%d entries retried' % retried)
 except KeyboardInterrupt:
     # Don't load anything else for the moment
     pass
@@ -24,7 +32,7 @@ df = pd.DataFrame(
         [
             feed.name, 
             feed.num_entries, 
-            sum(e.downloaded for e in feed.get_entries())
+            feed.stats.get()['flags']['downloaded']
         ]
         for feed in feeds
     ],
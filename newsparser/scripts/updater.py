@@ -6,11 +6,19 @@ import pandas as pd
 from newsparser.updater import update_local
 from newsparser.data import load_feeds
 
+try:
+    from newsfilter.ffs import content_selectors
+except ImportError:
+    # Without newsfilter, articles are extracted by newspaper alone
+    content_selectors = dict
+
 folder = '/Users/alvaro_parafita/Desktop/TFG/data'
 
 # Update local files
 try:
-    update_local(folder, download_content=True)
+    update_local(
+        folder, download_content=True, selectors=content_selectors()
+    )
 except KeyboardInterrupt:
     # Don't load anything else for the moment
     pass
@@ -6,11 +6,10 @@ import os.path
 from flask import Flask, request, render_template, redirect, url_for
 app = Flask(__name__)
 
-from pymongo import MongoClient
+from newsparser.storage import database
 
-mongo_client = MongoClient()
-entries_db = mongo_client.entries
-tests_db = mongo_client.newstagger
+entries_db = database('entries')
+tests_db = database('newstagger')
 
 from newsparser.data import load_feeds
 